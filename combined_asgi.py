@@ -5,21 +5,22 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
 django.setup()
 
 
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
 from starlette.applications import Starlette
+from starlette.middleware import Middleware
 from starlette.routing import Mount
 from fastapi.staticfiles import StaticFiles
-from collections import deque
 from dotenv import load_dotenv
 from fastapi_app.endpoints.users import router as users_router
 from fastapi_app.endpoints.documents import router as documents_router
 from fastapi_app.endpoints.my_collections import router as collections_router
+from fastapi_app.endpoints.jobs import heartbeat as jobs_heartbeat, router as jobs_router
+from fastapi_app.endpoints.metrics_history import flusher as metrics_flusher, router as metrics_history_router
+from fastapi_app.endpoints import compute, database, metrics, passwords, storage_usage, tf_cache
+from fastapi_app.endpoints.analytics import AnalyticsError
 
-import sqlite3
-import datetime
-import json
-import threading
-import time
 
 
 
@@ -35,85 +36,31 @@ django_app = get_asgi_application()
 fastapi_app.include_router(users_router, prefix="/users", tags=["Users"])
 fastapi_app.include_router(documents_router, prefix="/documents", tags=["Documents"])
 fastapi_app.include_router(collections_router, prefix="/collections", tags=["Collections"])
+fastapi_app.include_router(jobs_router, prefix="/jobs", tags=["Jobs"])
+fastapi_app.include_router(metrics_history_router, prefix="/metrics", tags=["Metrics"])
 
 
 APP_VERSION = "1.0.0"
 
 
-DB_PATH = os.getenv("DB_PATH")
-UPLOAD_DIR = os.getenv("UPLOAD_DIR")
+@fastapi_app.exception_handler(AnalyticsError)
+async def analytics_error_handler(request: Request, exc: AnalyticsError):
+    return JSONResponse(status_code=exc.status_code, content={"detail": exc.detail})
 
 
-
-
-def init_db():
-    conn = sqlite3.connect("baza.db")
-    cursor = conn.cursor()
-
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS main_user (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        username TEXT UNIQUE NOT NULL,
-        password TEXT NOT NULL
+@fastapi_app.exception_handler(compute.ComputeSaturated)
+async def compute_saturated_handler(request: Request, exc: compute.ComputeSaturated):
+    return JSONResponse(
+        status_code=429,
+        content={"detail": "Сервер перегружен, повторите запрос позже"},
+        headers={"Retry-After": "5"},
     )
-    """)
-
-    conn.commit()
-    conn.close()
-
-
-
-request_lock = threading.Lock()
-response_times = []  
-request_timestamps = deque()  
-
-
-def save_metrics(metrics_data):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS metrics (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            timestamp TEXT,
-            data TEXT
-        )
-    ''')
-    cursor.execute('''
-        INSERT INTO metrics (timestamp, data) VALUES (?, ?)
-    ''', (datetime.datetime.now().isoformat(), json.dumps(metrics_data)))
-    conn.commit()
-    conn.close()
-
-def get_directory_size_mb(path):
-    total_size = 0
-    for dirpath, dirnames, filenames in os.walk(path):
-        for f in filenames:
-            fp = os.path.join(dirpath, f)
-            if os.path.isfile(fp):
-                total_size += os.path.getsize(fp)
-    return round(total_size / (1024 * 1024), 2)  
 
 
+@fastapi_app.exception_handler(compute.ComputeTimeout)
+async def compute_timeout_handler(request: Request, exc: compute.ComputeTimeout):
+    return JSONResponse(status_code=504, content={"detail": "Превышено время вычисления"})
 
-@fastapi_app.middleware("http")
-async def metrics_middleware(request: Request, call_next):
-    global response_times, request_timestamps
-
-    start = time.time()
-    response = await call_next(request)
-    duration = time.time() - start
-
-    with request_lock:
-        response_times.append(duration)
-        now = time.time()
-        request_timestamps.append(now)
-
-
-        five_min_ago = now - 300
-        while request_timestamps and request_timestamps[0] < five_min_ago:
-            request_timestamps.popleft()
-
-    return response
 
 @fastapi_app.get("/status")
 def get_status():
@@ -121,18 +68,36 @@ def get_status():
 
 @fastapi_app.get("/metrics")
 def get_metrics():
-    with request_lock:
-        avg_response_time = round(sum(response_times) / len(response_times), 4) if response_times else 0
-        request_count_last_5min = len(request_timestamps)
+    metrics_data = metrics.registry.snapshot()
+    metrics_data["tf_cache"] = tf_cache.stats()
+    metrics_data["compute"] = compute.stats()
 
+    conn = database.get_db_connection()
+    upload_bytes, documents = storage_usage.get_usage(conn.cursor(), storage_usage.GLOBAL_USAGE_ID)
+    conn.close()
+    metrics_data["storage"] = {"upload_dir_bytes": upload_bytes, "documents": documents}
+    return metrics_data
 
-    metrics_data = {
-        "avg_response_time": avg_response_time,
-        "request_count_last_5min": request_count_last_5min,
-    }
+@fastapi_app.get("/metrics/prometheus", response_class=PlainTextResponse)
+def get_prometheus_metrics():
+    conn = database.get_db_connection()
+    cursor = conn.cursor()
+    # Занятое место и число документов берутся из счётчиков, без обхода каталога
+    upload_bytes, documents = storage_usage.get_usage(cursor, storage_usage.GLOBAL_USAGE_ID)
+    cursor.execute("SELECT (SELECT COUNT(*) FROM main_user), (SELECT COUNT(*) FROM main_collection)")
+    users, collections = cursor.fetchone()
+    conn.close()
 
-    save_metrics(metrics_data)
-    return metrics_data
+    gauges = [
+        ("app_upload_dir_bytes", "Размер каталога загрузок в байтах", upload_bytes),
+        ("app_documents", "Количество документов", documents),
+        ("app_users", "Количество пользователей", users),
+        ("app_collections", "Количество коллекций", collections),
+    ]
+    return PlainTextResponse(
+        metrics.render_prometheus(metrics.registry, gauges),
+        media_type="text/plain; version=0.0.4; charset=utf-8",
+    )
 
 @fastapi_app.get("/version")
 def get_version():
@@ -140,10 +105,31 @@ def get_version():
 
 
 
+@asynccontextmanager
+async def lifespan(app):
+    # Схема создаётся один раз при старте, а не на каждый запрос
+    database.pool.ensure_schema()
+    metrics_flusher.start()
+    storage_usage.reconciler.start()
+    jobs_heartbeat.start()
+    yield
+    await jobs_heartbeat.stop()
+    await storage_usage.reconciler.stop()
+    await metrics_flusher.stop()
+    compute.shutdown()
+    passwords.shutdown()
+    database.pool.close_all()
+
+
+fastapi_mount = Mount("/api", app=fastapi_app)
+django_mount = Mount("/", app=django_app)
+
 app = Starlette(routes=[
-    Mount("/api", app=fastapi_app),
-    Mount("/", app=django_app),
-])
+    fastapi_mount,
+    django_mount,
+], middleware=[
+    Middleware(metrics.MetricsMiddleware, mounts={"fastapi": fastapi_mount, "django": django_mount}),
+], lifespan=lifespan)
 
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
@@ -0,0 +1,198 @@
+import json
+import math
+
+import numpy as np
+
+from fastapi_app.endpoints import huffman, similarity
+from fastapi_app.endpoints.decoding import DECODE_ERRORS, detect_encoding
+from fastapi_app.endpoints.database import get_db_connection
+from fastapi_app.endpoints.inverted_index import ensure_indexed, ensure_user_indexed, user_document_count
+from fastapi_app.endpoints.term_counts import top_k_indices
+from fastapi_app.endpoints.tf_cache import get_term_counts
+from fastapi_app.endpoints.tokenizer import count_chars, iter_text_chunks
+
+
+# Функции этого модуля выполняются в процессах пула вычислений (compute.py),
+# поэтому модуль не должен зависеть от Django и FastAPI.
+
+
+class AnalyticsError(Exception):
+    def __init__(self, status_code, detail):
+        super().__init__(status_code, detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def document_statistics(document_id, user_id):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+
+    # Получаем путь к текущему документу
+    cursor.execute(
+        "SELECT path, content_hash, encoding FROM main_document WHERE id = ? AND user_id = ?",
+        (document_id, user_id)
+    )
+    row = cursor.fetchone()
+    if not row:
+        conn.close()
+        raise AnalyticsError(404, "Документ не найден")
+
+    ensure_user_indexed(cursor, user_id)
+    if not ensure_indexed(cursor, document_id, user_id, row["path"], row["content_hash"], row["encoding"]):
+        conn.close()
+        raise AnalyticsError(404, "Файл не найден")
+    conn.commit()
+
+    cursor.execute("SELECT total_terms FROM main_document_index WHERE document_id = ?", (document_id,))
+    total_terms = cursor.fetchone()["total_terms"]
+    total_docs = user_document_count(cursor, user_id)
+
+    # TF-IDF для 50 наименее частых слов (по TF), DF берём из индекса
+    cursor.execute("""
+        SELECT t.term, t.count, df.doc_count
+        FROM main_document_terms t
+        JOIN main_term_df df ON df.user_id = ? AND df.term = t.term
+        WHERE t.document_id = ?
+        ORDER BY t.count, t.term
+        LIMIT 50
+    """, (user_id, document_id))
+    statistics = []
+
+    for term_row in cursor.fetchall():
+        tf = round(term_row["count"] / total_terms, 6)
+        idf = round(math.log(total_docs / term_row["doc_count"]), 6)
+        statistics.append({
+            "word": term_row["term"],
+            "tf": tf,
+            "idf": idf
+        })
+    conn.close()
+
+    return {
+        "document_id": document_id,
+        "statistics": statistics
+    }
+
+
+def similar_documents(document_id, user_id, k):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            "SELECT path, content_hash, encoding FROM main_document WHERE id = ? AND user_id = ?",
+            (document_id, user_id)
+        )
+        row = cursor.fetchone()
+        if not row:
+            raise AnalyticsError(404, "Документ не найден")
+        # Матрица строится по всем документам пользователя, поэтому индексируем их все
+        ensure_user_indexed(cursor, user_id)
+        if not ensure_indexed(cursor, document_id, user_id, row["path"], row["content_hash"], row["encoding"]):
+            raise AnalyticsError(404, "Файл не найден")
+        conn.commit()
+
+        neighbours = similarity.similar_documents(cursor, user_id, document_id, k)
+        if neighbours is None:
+            raise AnalyticsError(404, "Документ не найден")
+        cursor.execute(
+            "SELECT id, name FROM main_document WHERE id IN (SELECT value FROM json_each(?))",
+            (json.dumps([neighbour_id for neighbour_id, _ in neighbours]),)
+        )
+        names = {r["id"]: r["name"] for r in cursor.fetchall()}
+    finally:
+        conn.close()
+
+    return {
+        "document_id": document_id,
+        "similar": [
+            {"id": neighbour_id, "name": names.get(neighbour_id), "score": round(score, 6)}
+            for neighbour_id, score in neighbours
+        ]
+    }
+
+
+def collection_statistics(collection_id, user_id):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+
+    # Документы, загруженные до появления индекса, индексируем при первом обращении — все сразу,
+    # иначе IDF считался бы по неполному корпусу
+    ensure_user_indexed(cursor, user_id)
+    conn.commit()
+
+    # IDF поддерживается инкрементально в main_term_df при загрузке/удалении документов
+    total_docs = user_document_count(cursor, user_id)
+    if not total_docs:
+        conn.close()
+        raise AnalyticsError(400, "У пользователя нет документов для расчёта IDF")
+
+    # TF: как будто все документы в коллекции — один документ (разреженная сумма частот)
+    cursor.execute("""
+        SELECT t.term, SUM(t.count) AS count, df.doc_count
+        FROM main_collection_documents cd
+        JOIN main_document d ON d.id = cd.document_id
+        JOIN main_document_terms t ON t.document_id = cd.document_id
+        JOIN main_term_df df ON df.user_id = d.user_id AND df.term = t.term
+        WHERE cd.collection_id = ? AND d.user_id = ?
+        GROUP BY t.term
+    """, (collection_id, user_id))
+    term_rows = cursor.fetchall()
+    conn.close()
+
+    if not term_rows:
+        raise AnalyticsError(400, "Коллекция пуста или документы недоступны")
+
+    # Те же формулы, что у TfidfVectorizer: сглаженный IDF и L2-нормировка вектора TF*IDF
+    terms, counts, doc_counts = zip(*term_rows)
+    counts = np.array(counts, dtype=np.int64)
+    idf_scores = np.log((1 + total_docs) / (1 + np.array(doc_counts, dtype=np.float64))) + 1
+    norm = float(np.linalg.norm(counts * idf_scores))
+
+    # tf пропорционален частоте, поэтому берём 50 самых редких слов частичной выборкой
+    tfidf_data = [
+        {
+            "word": terms[i],
+            "tf": round(int(counts[i]) / norm, 6),
+            "idf": round(float(idf_scores[i]), 6)
+        }
+        for i in top_k_indices(counts, 50, terms, largest=False)
+    ]
+
+    return {
+        "collection_id": collection_id,
+        "rare_words": tfidf_data
+    }
+
+
+def byte_code_lengths(path):
+    return huffman.file_code_lengths(lambda: open(path, "rb"))
+
+
+def huffman_text(path, encoding, lengths=None):
+    # Частоты и кодирование — по кускам, без копии всего текста в памяти
+    # (сам ответ в JSON-режиме по-прежнему пропорционален размеру файла)
+    if lengths is None:
+        char_counts = count_chars(path, encoding, DECODE_ERRORS)
+        if not char_counts:
+            raise AnalyticsError(400, "Не удалось построить дерево Хаффмана (пустой файл?)")
+        lengths = huffman.code_lengths(char_counts)
+    code_map = huffman.code_map(lengths)
+
+    size = 0
+    encoded = []
+    for chunk in iter_text_chunks(path, encoding, DECODE_ERRORS):
+        size += len(chunk)
+        encoded.append("".join(map(code_map.__getitem__, chunk)))
+    if not size:
+        raise AnalyticsError(400, "Не удалось построить дерево Хаффмана (пустой файл?)")
+    return (size, lengths), "".join(encoded), code_map
+
+
+def uploaded_file_tfidf(path):
+    # Кодировка определяется по началу файла, сам файл читается один раз
+    encoding = detect_encoding(path)
+
+    # Для одного документа IDF одинаков для всех слов, поэтому TF-IDF — это L2-нормированные частоты
+    term_counts = get_term_counts(path, encoding=encoding, errors=DECODE_ERRORS)
+    norm = term_counts.norm()
+    return [(word, count / norm) for word, count in term_counts.top_k(50)]
@@ -1,4 +1,6 @@
+import hashlib
 import os
+import time
 from datetime import datetime, timedelta
 from typing import Optional
 from fastapi import Depends, HTTPException, status
@@ -6,8 +8,17 @@ from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 from dotenv import load_dotenv
 
+# До импорта database: он читает DB_PATH при загрузке модуля
 load_dotenv()
 
+from fastapi_app.endpoints.database import get_db_connection
+from fastapi_app.endpoints.lru import LRUCache
+
+try:
+    import jwt as pyjwt
+except ImportError:
+    pyjwt = None
+
 SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = os.getenv("ALGORITHM")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES"))
@@ -15,6 +26,22 @@ ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES"))
 if not SECRET_KEY or not ALGORITHM:
     raise RuntimeError("SECRET_KEY и ALGORITHM должны быть заданы в .env")
 
+# jose (по умолчанию) или pyjwt; основной выигрыш даёт кэш проверенных токенов ниже
+JWT_BACKEND = os.getenv("JWT_BACKEND", "jose")
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+# Как долго процесс доверяет закэшированной версии токенов пользователя;
+# в пределах процесса отзыв действует сразу, в других воркерах — не позже чем через это время
+TOKEN_VERSION_TTL_SECONDS = float(os.getenv("TOKEN_VERSION_TTL_SECONDS", "5"))
+
+if JWT_BACKEND == "pyjwt" and pyjwt is None:
+    raise RuntimeError("JWT_BACKEND=pyjwt, но пакет PyJWT не установлен")
+use_pyjwt = JWT_BACKEND == "pyjwt"
+
+# sha256(токен) -> (user_id, версия токенов, exp): подпись проверяется один раз на токен
+verified_tokens = LRUCache(max_items=TOKEN_CACHE_SIZE)
+# user_id -> (версия токенов, момент устаревания записи)
+token_versions = LRUCache(max_items=TOKEN_CACHE_SIZE)
+
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/login")
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
@@ -24,23 +51,68 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def verify_token(token: str):
+def invalid_token(detail="Неверный токен"):
+    return HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail=detail,
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+
+
+def decode_token(token: str):
+    if use_pyjwt:
+        try:
+            return pyjwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        except pyjwt.InvalidTokenError:
+            raise invalid_token()
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id = payload.get("sub")
-        if user_id is None:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Неверный токен",
-                headers={"WWW-Authenticate": "Bearer"},
-            )
-        return int(user_id)
-    except (JWTError, ValueError):
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Неверный токен",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
+        return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        raise invalid_token()
+
+
+def current_token_version(user_id: int):
+    cached = token_versions.get(user_id)
+    if cached is not None and cached[1] > time.monotonic():
+        return cached[0]
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT token_version FROM main_user WHERE id = ?", (user_id,))
+    row = cursor.fetchone()
+    conn.close()
+    # Пользователь удалён — все его токены недействительны
+    version = row["token_version"] if row else None
+    token_versions.put(user_id, (version, time.monotonic() + TOKEN_VERSION_TTL_SECONDS))
+    return version
+
+
+def forget_token_version(user_id: int):
+    # Вызывать после commit, иначе в кэш может попасть старая версия
+    token_versions.pop(user_id)
+
+
+def verify_token(token: str):
+    key = hashlib.sha256(token.encode()).digest()
+    cached = verified_tokens.get(key)
+    if cached is None:
+        payload = decode_token(token)
+        try:
+            user_id = int(payload["sub"])
+            version = int(payload.get("ver", 0))
+            expires_at = float(payload["exp"])
+        except (KeyError, TypeError, ValueError):
+            raise invalid_token()
+        cached = (user_id, version, expires_at)
+        verified_tokens.put(key, cached)
+
+    user_id, version, expires_at = cached
+    if expires_at <= time.time():
+        verified_tokens.pop(key)
+        raise invalid_token()
+    if current_token_version(user_id) != version:
+        raise invalid_token("Токен отозван")
+    return user_id
 
 def     get_current_user(token: str = Depends(oauth2_scheme)) -> int:
     return verify_token(token)
@@ -0,0 +1,81 @@
+import hashlib
+import os
+import uuid
+
+from fastapi_app.endpoints.storage_usage import GLOBAL_USAGE_ID, add_usage
+
+
+UPLOAD_DIR = os.getenv("UPLOAD_DIR")
+MAX_UPLOAD_SIZE_MB = float(os.getenv("MAX_UPLOAD_SIZE_MB", "100"))
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+def blob_path(content_hash):
+    return os.path.join(UPLOAD_DIR, content_hash[:2], content_hash)
+
+
+def new_tmp_path():
+    tmp_dir = os.path.join(UPLOAD_DIR, ".tmp")
+    os.makedirs(tmp_dir, exist_ok=True)
+    return os.path.join(tmp_dir, uuid.uuid4().hex)
+
+
+def receive_stream(stream, max_size=None):
+    # Пишем поток кусками во временный каталог, по дороге считая SHA-256 и размер
+    if max_size is None:
+        max_size = int(MAX_UPLOAD_SIZE_MB * 1024 * 1024)
+    tmp_path = new_tmp_path()
+
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(tmp_path, "wb") as buffer:
+            for chunk in iter(lambda: stream.read(UPLOAD_CHUNK_SIZE), b""):
+                size += len(chunk)
+                if size > max_size:
+                    raise UploadTooLarge()
+                digest.update(chunk)
+                buffer.write(chunk)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return tmp_path, digest.hexdigest(), size
+
+
+def add_reference(cursor, tmp_path, content_hash, size):
+    # Файловые операции выполняются после первой записи в транзакции,
+    # то есть под блокировкой записи SQLite — параллельное удаление того же блоба невозможно
+    path = blob_path(content_hash)
+    cursor.execute("""
+        INSERT INTO main_blob (content_hash, path, size, ref_count) VALUES (?, ?, ?, 1)
+        ON CONFLICT(content_hash) DO UPDATE SET ref_count = ref_count + 1
+    """, (content_hash, path, size))
+    if os.path.exists(path):
+        os.remove(tmp_path)
+    else:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(tmp_path, path)
+        add_usage(cursor, GLOBAL_USAGE_ID, size)
+    return path
+
+
+def remove_file(cursor, path):
+    if os.path.exists(path):
+        size = os.path.getsize(path)
+        os.remove(path)
+        add_usage(cursor, GLOBAL_USAGE_ID, -size)
+
+
+def release_reference(cursor, path):
+    cursor.execute("UPDATE main_blob SET ref_count = ref_count - 1 WHERE path = ?", (path,))
+    if cursor.rowcount == 0:
+        # Файл загружен до появления блобов и принадлежит одному документу
+        remove_file(cursor, path)
+        return
+    cursor.execute("DELETE FROM main_blob WHERE path = ? AND ref_count <= 0", (path,))
+    if cursor.rowcount:
+        remove_file(cursor, path)
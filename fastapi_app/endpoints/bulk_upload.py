@@ -0,0 +1,269 @@
+import os
+import tarfile
+import threading
+import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from fastapi_app.endpoints import full_text
+from fastapi_app.endpoints.blob_storage import MAX_UPLOAD_SIZE_MB, UploadTooLarge, add_reference, receive_stream
+from fastapi_app.endpoints.database import get_db_connection
+from fastapi_app.endpoints.decoding import DECODE_ERRORS, detect_encoding
+from fastapi_app.endpoints.inverted_index import index_new_documents, read_term_counts
+from fastapi_app.endpoints.multipart_upload import RequestTooLarge
+from fastapi_app.endpoints.storage_usage import StorageQuotaExceeded, remaining_quota, reserve_usage
+from fastapi_app.endpoints.tf_cache import get_term_counts
+
+
+# Массовая загрузка: части multipart уже лежат во временном каталоге, содержимое zip/tar
+# параллельно распаковывается туда же, для каждого файла заранее определяется кодировка
+# и считаются частоты слов (они попадают в кэш токенизации). Затем все документы
+# добавляются одной транзакцией.
+BULK_UPLOAD_WORKERS = int(os.getenv("BULK_UPLOAD_WORKERS", str(min(8, os.cpu_count() or 1))))
+BULK_UPLOAD_MAX_FILES = int(os.getenv("BULK_UPLOAD_MAX_FILES", "100000"))
+# Ограничивает и тело запроса, и суммарный размер файлов после распаковки архивов
+BULK_UPLOAD_MAX_TOTAL_MB = float(os.getenv("BULK_UPLOAD_MAX_TOTAL_MB", "1024"))
+ZIP_SUFFIXES = (".zip",)
+TAR_SUFFIXES = (".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz")
+# Ошибки чтения повреждённого или зашифрованного файла из архива
+ARCHIVE_READ_ERRORS = (OSError, EOFError, RuntimeError, zlib.error, zipfile.BadZipFile, tarfile.TarError)
+
+
+class TooManyFiles(Exception):
+    pass
+
+
+class StagingBudget:
+    # Сколько байт запрос может записать во временный каталог. Превышение общего лимита
+    # обрывает весь запрос (архив-бомба не заполнит диск); файл, не помещающийся в остаток
+    # квоты, получает ошибку, остальные продолжают загружаться
+    def __init__(self, max_total, quota):
+        self.max_total = max_total
+        self.quota = quota
+        self.total = 0
+        self.kept = 0
+        self._lock = threading.Lock()
+
+    def check(self):
+        if self.total > self.max_total:
+            raise RequestTooLarge()
+
+    def charge(self, size):
+        with self._lock:
+            self.total += size
+            self.check()
+            if self.quota is not None and self.kept + size > self.quota:
+                raise StorageQuotaExceeded()
+            self.kept += size
+
+    def release(self, size):
+        with self._lock:
+            self.kept -= size
+
+
+class BudgetedReader:
+    def __init__(self, stream, budget):
+        self.stream = stream
+        self.budget = budget
+        self.charged = 0
+
+    def read(self, size=-1):
+        chunk = self.stream.read(size)
+        self.budget.charge(len(chunk))
+        self.charged += len(chunk)
+        return chunk
+
+
+class Entry:
+    def __init__(self, filename):
+        self.filename = filename
+        self.tmp_path = None
+        self.content_hash = None
+        self.size = None
+        self.encoding = None
+        self.path = None
+        self.document_id = None
+        self.error = None
+
+    def result(self):
+        if self.error:
+            return {"filename": self.filename, "status": "error", "detail": self.error}
+        return {"filename": self.filename, "status": "ok", "document_id": self.document_id}
+
+
+def archive_kind(filename):
+    name = (filename or "").lower()
+    if name.endswith(ZIP_SUFFIXES):
+        return "zip"
+    if name.endswith(TAR_SUFFIXES):
+        return "tar"
+    return None
+
+
+def iter_sources(sources, entries, archives):
+    # (запись, функция открытия потока или None для уже записанного файла, можно ли читать
+    # параллельно с другими файлами). Члены zip читаются независимо, tar (особенно сжатый) —
+    # только по порядку. Архивы закрывает вызывающий, когда все файлы из них прочитаны
+    for source in sources:
+        kind = archive_kind(source.filename)
+        if kind is None:
+            entry = Entry(source.filename)
+            entry.tmp_path, entry.content_hash, entry.size = source.tmp_path, source.content_hash, source.size
+            entries.append(entry)
+            yield entry, None, True
+            continue
+
+        try:
+            archive = zipfile.ZipFile(source.tmp_path) if kind == "zip" else tarfile.open(source.tmp_path, mode="r:*")
+        except ARCHIVE_READ_ERRORS:
+            entry = Entry(source.filename)
+            entry.error = "Не удалось прочитать архив"
+            entries.append(entry)
+            continue
+
+        archives.append(archive)
+        if kind == "zip":
+            members = ((info.filename, partial(archive.open, info)) for info in archive.infolist() if not info.is_dir())
+        else:
+            members = ((info.name, partial(archive.extractfile, info)) for info in archive if info.isfile())
+        try:
+            for name, opener in members:
+                entry = Entry(name)
+                entries.append(entry)
+                yield entry, opener, kind == "zip"
+        except ARCHIVE_READ_ERRORS:
+            entry = Entry(source.filename)
+            entry.error = "Архив повреждён, прочитана только его часть"
+            entries.append(entry)
+
+
+def receive_entry(entry, opener, budget):
+    reader = None
+    try:
+        if opener is None:
+            # Обычный файл записан во временный каталог ещё при разборе запроса
+            if entry.size > MAX_UPLOAD_SIZE_MB * 1024 * 1024:
+                raise UploadTooLarge()
+            budget.charge(entry.size)
+            return
+        with opener() as stream:
+            reader = BudgetedReader(stream, budget)
+            entry.tmp_path, entry.content_hash, entry.size = receive_stream(reader)
+    except UploadTooLarge:
+        entry.error = f"Файл превышает допустимый размер ({MAX_UPLOAD_SIZE_MB:g} МБ)"
+    except StorageQuotaExceeded:
+        entry.error = "Превышена квота на хранение файлов"
+    except ARCHIVE_READ_ERRORS:
+        entry.error = "Не удалось прочитать файл"
+    if entry.error and reader is not None:
+        budget.release(reader.charged)
+
+
+def prepare_entry(entry):
+    if entry.error:
+        return
+    entry.encoding = detect_encoding(entry.tmp_path)
+    get_term_counts(entry.tmp_path, entry.content_hash, entry.encoding, DECODE_ERRORS)
+
+
+def receive_and_prepare(entry, opener, budget):
+    receive_entry(entry, opener, budget)
+    prepare_entry(entry)
+
+
+def next_document_id(cursor):
+    # Вызывается под блокировкой записи. У AUTOINCREMENT id не переиспользуются,
+    # поэтому учитываем и sqlite_sequence, а не только MAX(id)
+    cursor.execute("""
+        SELECT MAX(
+            COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'main_document'), 0),
+            COALESCE((SELECT MAX(id) FROM main_document), 0)
+        )
+    """)
+    return cursor.fetchone()[0] + 1
+
+
+def store_entries(entries, user_id):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        stored = []
+        for entry in entries:
+            if entry.error:
+                continue
+            try:
+                reserve_usage(cursor, user_id, entry.size)
+            except StorageQuotaExceeded:
+                entry.error = "Превышена квота на хранение файлов"
+                continue
+            entry.path = add_reference(cursor, entry.tmp_path, entry.content_hash, entry.size)
+            stored.append(entry)
+        if not stored:
+            conn.commit()
+            return
+
+        # id назначаем сами, чтобы вставить все строки одним executemany
+        first_id = next_document_id(cursor)
+        for offset, entry in enumerate(stored):
+            entry.document_id = first_id + offset
+        cursor.executemany(
+            "INSERT INTO main_document (id, name, path, user_id, content_hash, size, encoding) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [
+                (entry.document_id, entry.filename, entry.path, user_id, entry.content_hash, entry.size, entry.encoding)
+                for entry in stored
+            ]
+        )
+        # Частоты берутся из кэша токенизации, заполненного на этапе подготовки
+        index_new_documents(cursor, user_id, (
+            (entry.document_id, read_term_counts(cursor, entry.document_id, entry.path, entry.content_hash, entry.encoding))
+            for entry in stored
+        ))
+        conn.commit()
+    finally:
+        conn.close()
+    full_text.index_committed(
+        user_id, ((entry.document_id, entry.filename, entry.path, entry.encoding) for entry in stored)
+    )
+
+
+def ingest(sources, user_id):
+    # sources — принятые части multipart (ReceivedFile); возвращает результат по каждому файлу.
+    # Временные файлы архивов (и частей, до которых не дошла очередь) удаляет вызывающий — discard
+    budget = StagingBudget(int(BULK_UPLOAD_MAX_TOTAL_MB * 1024 * 1024), remaining_quota(user_id))
+    entries = []
+    archives = []
+    futures = []
+    try:
+        # Выход из with дожидается всех задач; при ошибке ещё не начатые отменяются
+        with ThreadPoolExecutor(max_workers=BULK_UPLOAD_WORKERS) as executor:
+            try:
+                for entry, opener, parallel in iter_sources(sources, entries, archives):
+                    if len(entries) > BULK_UPLOAD_MAX_FILES:
+                        raise TooManyFiles()
+                    budget.check()
+                    if parallel:
+                        futures.append(executor.submit(receive_and_prepare, entry, opener, budget))
+                    else:
+                        receive_entry(entry, opener, budget)
+                        futures.append(executor.submit(prepare_entry, entry))
+            except BaseException:
+                executor.shutdown(cancel_futures=True)
+                raise
+        for future in futures:
+            future.result()
+        store_entries(entries, user_id)
+    finally:
+        for archive in archives:
+            archive.close()
+        # Временные файлы остаются только у записей, не попавших в хранилище
+        for entry in entries:
+            if entry.tmp_path and os.path.exists(entry.tmp_path):
+                os.remove(entry.tmp_path)
+    return [entry.result() for entry in entries]
+
+
+def discard(sources):
+    for source in sources:
+        if source.tmp_path and os.path.exists(source.tmp_path):
+            os.remove(source.tmp_path)
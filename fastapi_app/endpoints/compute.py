@@ -0,0 +1,83 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+
+COMPUTE_WORKERS = int(os.getenv("COMPUTE_WORKERS") or os.cpu_count() or 2)
+COMPUTE_QUEUE_SIZE = int(os.getenv("COMPUTE_QUEUE_SIZE", "16"))
+# Меньше proxy_read_timeout в nginx.conf, чтобы клиент получил осмысленную ошибку
+COMPUTE_TIMEOUT_SECONDS = float(os.getenv("COMPUTE_TIMEOUT_SECONDS", "55"))
+
+
+class ComputeSaturated(Exception):
+    pass
+
+
+class ComputeTimeout(Exception):
+    pass
+
+
+# Одновременно принимаем не больше COMPUTE_WORKERS выполняющихся и COMPUTE_QUEUE_SIZE ожидающих задач
+_slots = threading.BoundedSemaphore(COMPUTE_WORKERS + COMPUTE_QUEUE_SIZE)
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # spawn: рабочие процессы не наследуют потоки и соединения uvicorn/Django
+            _executor = ProcessPoolExecutor(
+                max_workers=COMPUTE_WORKERS,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _executor
+
+
+def shutdown():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
+
+
+def submit(fn, *args):
+    if not _slots.acquire(blocking=False):
+        raise ComputeSaturated()
+    try:
+        future = get_executor().submit(fn, *args)
+    except BaseException:
+        _slots.release()
+        raise
+    # Слот освобождается, когда задача действительно завершилась, а не когда клиент перестал ждать
+    future.add_done_callback(lambda _: _slots.release())
+    return future
+
+
+async def run(fn, *args, timeout=COMPUTE_TIMEOUT_SECONDS):
+    future = submit(fn, *args)
+    try:
+        return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+    except asyncio.TimeoutError:
+        raise ComputeTimeout()
+
+
+def run_sync(fn, *args, timeout=COMPUTE_TIMEOUT_SECONDS):
+    future = submit(fn, *args)
+    try:
+        return future.result(timeout)
+    except TimeoutError:
+        future.cancel()
+        raise ComputeTimeout()
+
+
+def stats():
+    return {
+        "workers": COMPUTE_WORKERS,
+        "capacity": COMPUTE_WORKERS + COMPUTE_QUEUE_SIZE,
+        "available_slots": _slots._value,
+    }
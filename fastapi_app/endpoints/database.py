@@ -1,11 +1,120 @@
 import sqlite3
 import os
+import queue
+import threading
 
 
 DB_PATH = os.getenv("DB_PATH")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "16"))
+DB_CACHE_SIZE_MB = int(os.getenv("DB_CACHE_SIZE_MB", "64"))
+DB_MMAP_SIZE_MB = int(os.getenv("DB_MMAP_SIZE_MB", "256"))
+DB_BUSY_TIMEOUT_SECONDS = float(os.getenv("DB_BUSY_TIMEOUT_SECONDS", "10"))
+
+
+class PooledConnection(sqlite3.Connection):
+    # close() возвращает соединение в пул, а не закрывает его
+    pool = None
+
+    def close(self):
+        if self.pool is None:
+            super().close()
+        else:
+            self.pool.release(self)
+
+    def really_close(self):
+        super().close()
+
+
+class ConnectionPool:
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+        self._idle = queue.LifoQueue(maxsize=size)
+        self._pid = os.getpid()
+        self._schema_lock = threading.Lock()
+        self._schema_ready = False
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.path,
+            timeout=DB_BUSY_TIMEOUT_SECONDS,
+            check_same_thread=False,
+            cached_statements=256,
+            factory=PooledConnection,
+        )
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute(f"PRAGMA cache_size = {-DB_CACHE_SIZE_MB * 1024}")
+        conn.execute(f"PRAGMA mmap_size = {DB_MMAP_SIZE_MB * 1024 * 1024}")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        conn.pool = self
+        return conn
+
+    def _reset_after_fork(self):
+        # Соединения SQLite нельзя переносить между процессами
+        if self._pid != os.getpid():
+            self._idle = queue.LifoQueue(maxsize=self.size)
+            self._pid = os.getpid()
+
+    def ensure_schema(self):
+        if self._schema_ready:
+            return
+        with self._schema_lock:
+            if not self._schema_ready:
+                init_db()
+                self._schema_ready = True
+
+    def acquire(self):
+        self._reset_after_fork()
+        self.ensure_schema()
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        if self._pid != os.getpid():
+            return
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.really_close()
+
+    def close_all(self):
+        while True:
+            try:
+                self._idle.get_nowait().really_close()
+            except queue.Empty:
+                return
+
+
+pool = ConnectionPool(DB_PATH, DB_POOL_SIZE)
+
+
+def get_db_connection():
+    return pool.acquire()
+
+
+def add_column_if_missing(cursor, table, column, definition):
+    cursor.execute(f"PRAGMA table_info({table})")
+    if column not in [row[1] for row in cursor.fetchall()]:
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
 
 def init_db():
-    conn = sqlite3.connect(DB_PATH)
+    conn = sqlite3.connect(DB_PATH, timeout=DB_BUSY_TIMEOUT_SECONDS)
+    try:
+        create_schema(conn)
+        apply_migrations(conn)
+    finally:
+        conn.close()
+
+
+def create_schema(conn):
     cursor = conn.cursor()
 
     # main_user
@@ -49,5 +158,214 @@ def init_db():
     )
     """)
 
+    # Хранилище файлов по хэшу содержимого со счётчиком ссылок
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS main_blob (
+        content_hash TEXT PRIMARY KEY,
+        path TEXT UNIQUE NOT NULL,
+        size INTEGER NOT NULL,
+        ref_count INTEGER NOT NULL
+    )
+    """)
+
+    # Длины кодов Хаффмана документа: kind = 'text' (символы) или 'bytes' (бинарный формат)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS main_document_huffman (
+        document_id INTEGER NOT NULL,
+        kind TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        lengths TEXT NOT NULL,
+        PRIMARY KEY (document_id, kind),
+        FOREIGN KEY (document_id) REFERENCES main_document(id)
+    )
+    """)
+
+    # Инвертированный индекс: количество слов в документе
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS main_document_index (
+        document_id INTEGER PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        total_terms INTEGER NOT NULL,
+        FOREIGN KEY (document_id) REFERENCES main_document(id)
+    )
+    """)
+
+    # Инвертированный индекс: частоты слов в документе
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS main_document_terms (
+        document_id INTEGER NOT NULL,
+        term TEXT NOT NULL,
+        count INTEGER NOT NULL,
+        PRIMARY KEY (document_id, term)
+    ) WITHOUT ROWID
+    """)
+
+    # Инвертированный индекс: в скольких документах пользователя встречается слово
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS main_term_df (
+        user_id INTEGER NOT NULL,
+        term TEXT NOT NULL,
+        doc_count INTEGER NOT NULL,
+        PRIMARY KEY (user_id, term)
+    ) WITHOUT ROWID
+    """)
+
+    # Инвертированный индекс: число проиндексированных документов пользователя
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS main_user_corpus (
+        user_id INTEGER PRIMARY KEY,
+        doc_count INTEGER NOT NULL
+    )
+    """)
+
+    # Фоновые задачи аналитики и их результаты (хранятся до expires_at)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS main_analytics_job (
+        id TEXT PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        kind TEXT NOT NULL,
+        target_id INTEGER NOT NULL,
+        fingerprint TEXT NOT NULL,
+        status TEXT NOT NULL,
+        result TEXT,
+        error TEXT,
+        error_code INTEGER,
+        created_at REAL NOT NULL,
+        expires_at REAL NOT NULL
+    )
+    """)
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS main_analytics_job_fingerprint
+    ON main_analytics_job (user_id, fingerprint)
+    """)
+
+    # Занятое место: user_id = 0 — весь каталог загрузок, остальные строки — по пользователям
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS main_storage_usage (
+        user_id INTEGER PRIMARY KEY,
+        bytes INTEGER NOT NULL DEFAULT 0,
+        documents INTEGER NOT NULL DEFAULT 0
+    )
+    """)
+
+    # Полнотекстовый поиск (full_text.py): rowid = id документа, owner — токен владельца
+    cursor.execute("""
+    CREATE VIRTUAL TABLE IF NOT EXISTS main_document_fts USING fts5(
+        name, content, owner,
+        tokenize = 'unicode61 remove_diacritics 2'
+    )
+    """)
+
+    # История метрик: по строке на ряд и отметку времени, resolution — шаг хранения в секундах
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS main_metrics_sample (
+        name TEXT NOT NULL,
+        resolution INTEGER NOT NULL,
+        timestamp INTEGER NOT NULL,
+        value REAL NOT NULL,
+        PRIMARY KEY (name, resolution, timestamp)
+    ) WITHOUT ROWID
+    """)
+
     conn.commit()
-    conn.close()
+
+
+def migration_0001_indexes(cursor):
+    # Ускоряем выборки по владельцу и проверки членства в коллекции
+    cursor.execute("CREATE INDEX IF NOT EXISTS main_document_user ON main_document (user_id, id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS main_collection_user ON main_collection (user_id, id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS main_document_index_user ON main_document_index (user_id)")
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS main_collection_documents_document "
+        "ON main_collection_documents (document_id)"
+    )
+    # Перед UNIQUE-индексом убираем дубли, которые могли появиться из-за гонки SELECT-then-INSERT
+    cursor.execute("""
+        DELETE FROM main_collection_documents
+        WHERE id NOT IN (
+            SELECT MIN(id) FROM main_collection_documents GROUP BY collection_id, document_id
+        )
+    """)
+    cursor.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS main_collection_documents_unique "
+        "ON main_collection_documents (collection_id, document_id)"
+    )
+
+
+# Колонки ниже могли появиться в базе ещё до миграций (их добавлял create_schema),
+# поэтому добавляются только при отсутствии
+
+
+def migration_0002_document_size(cursor):
+    # Размер файла в байтах — для счётчиков занятого места
+    add_column_if_missing(cursor, "main_document", "size", "INTEGER")
+
+
+def migration_0003_user_token_version(cursor):
+    # Номер поколения токенов: увеличивается при выходе, смене пароля и удалении
+    add_column_if_missing(cursor, "main_user", "token_version", "INTEGER NOT NULL DEFAULT 0")
+
+
+def migration_0004_document_encoding(cursor):
+    # Кодировка, определённая при загрузке; NULL — ещё не определялась
+    add_column_if_missing(cursor, "main_document", "encoding", "TEXT")
+
+
+def migration_0005_document_content_hash(cursor):
+    # SHA-256 содержимого файла — ключ кэша токенизации
+    add_column_if_missing(cursor, "main_document", "content_hash", "TEXT")
+
+
+def migration_0006_user_corpus_version(cursor):
+    # Версия корпуса пользователя: меняется при каждой загрузке и удалении документа
+    add_column_if_missing(cursor, "main_user_corpus", "version", "INTEGER NOT NULL DEFAULT 0")
+
+
+def migration_0007_job_heartbeat(cursor):
+    # Последняя отметка процесса, ожидающего результат задачи (jobs.py)
+    cursor.execute("ALTER TABLE main_analytics_job ADD COLUMN heartbeat_at REAL")
+
+
+def migration_0008_periodic_runs(cursor):
+    # Когда периодическую работу (сверку занятого места) можно запускать снова — общая для всех воркеров
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS main_periodic_run (
+            name TEXT PRIMARY KEY,
+            next_run_at REAL NOT NULL
+        )
+    """)
+
+
+# Версия схемы хранится в PRAGMA user_version; новые миграции добавляются в конец списка
+MIGRATIONS = [
+    (1, migration_0001_indexes),
+    (2, migration_0002_document_size),
+    (3, migration_0003_user_token_version),
+    (4, migration_0004_document_encoding),
+    (5, migration_0005_document_content_hash),
+    (6, migration_0006_user_corpus_version),
+    (7, migration_0007_job_heartbeat),
+    (8, migration_0008_periodic_runs),
+]
+
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def apply_migrations(conn):
+    if schema_version(conn) >= MIGRATIONS[-1][0]:
+        return
+    # BEGIN IMMEDIATE: параллельно стартующие процессы применяют миграции по очереди
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        current = schema_version(conn)
+        cursor = conn.cursor()
+        for version, migration in MIGRATIONS:
+            if version > current:
+                migration(cursor)
+                cursor.execute(f"PRAGMA user_version = {version}")
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
@@ -0,0 +1,80 @@
+import codecs
+import os
+
+
+# Определение кодировки по началу файла: UTF-8 проверяется первой, однобайтовые кириллические
+# и западные кодировки различаются простыми эвристиками без chardet.
+# Модуль используется и в процессах пула вычислений, поэтому не зависит от Django и FastAPI.
+
+ENCODING_SAMPLE_SIZE = int(os.getenv("ENCODING_SAMPLE_KB", "64")) * 1024
+# Байты, не подходящие к кодировке, заменяем на U+FFFD: выборка могла не встретить редкий символ
+DECODE_ERRORS = "replace"
+
+CYRILLIC_CANDIDATES = ("cp1251", "koi8-r", "cp866")
+WESTERN_ENCODING = "cp1252"
+
+BOMS = (
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+)
+
+
+def cyrillic_case_score(text):
+    # В правильной кодировке строчных букв в тексте заметно больше, чем заглавных
+    score = 0
+    for char in text:
+        if "а" <= char <= "я" or char == "ё":
+            score += 1
+        elif "А" <= char <= "Я" or char == "Ё":
+            score -= 1
+    return score
+
+
+def detect_bytes(sample, final=True):
+    for bom, encoding in BOMS:
+        if sample.startswith(bom):
+            return encoding
+
+    try:
+        # final=False — выборка могла оборваться посреди многобайтового символа
+        codecs.getincrementaldecoder("utf-8")().decode(sample, final)
+        return "utf-8"
+    except UnicodeDecodeError:
+        pass
+
+    # Западный текст в cp1252 состоит в основном из ASCII-букв; кириллица в любой
+    # однобайтовой кодировке даёт слова почти целиком из букв за пределами ASCII
+    letters = [char for char in sample.decode(WESTERN_ENCODING, errors="ignore") if char.isalpha()]
+    non_ascii = sum(1 for char in letters if ord(char) > 127)
+    if not letters or non_ascii / len(letters) < 0.5:
+        return WESTERN_ENCODING
+
+    return max(
+        CYRILLIC_CANDIDATES,
+        key=lambda encoding: cyrillic_case_score(sample.decode(encoding, errors="ignore"))
+    )
+
+
+def detect_encoding(path):
+    with open(path, "rb") as f:
+        sample = f.read(ENCODING_SAMPLE_SIZE)
+        final = len(sample) < ENCODING_SAMPLE_SIZE
+    return detect_bytes(sample, final)
+
+
+def document_encoding(cursor, document_id, path, encoding=None):
+    # Для документов, загруженных до появления колонки, определяем кодировку один раз и запоминаем
+    if encoding is None:
+        encoding = detect_encoding(path)
+        cursor.execute("UPDATE main_document SET encoding = ? WHERE id = ?", (encoding, document_id))
+    return encoding
+
+
+def open_text(path, encoding):
+    return open(path, "r", encoding=encoding, errors=DECODE_ERRORS)
+
+
+def read_text(path, encoding):
+    with open_text(path, encoding) as f:
+        return f.read()
@@ -1,249 +1,470 @@
-from fastapi import APIRouter, HTTPException, Depends, File, UploadFile
+from fastapi import APIRouter, HTTPException, Depends, File, Query, Request, Response, UploadFile
+from fastapi.responses import FileResponse, StreamingResponse
+from fastapi_app.endpoints import analytics, compute, huffman
+from fastapi_app.endpoints.lru import LRUCache
 from fastapi_app.endpoints.auth import get_current_user
-from fastapi_app.endpoints.database import init_db  
-from collections import Counter
+from fastapi_app.endpoints.database import get_db_connection
+from fastapi_app.endpoints.decoding import DECODE_ERRORS, detect_encoding, document_encoding, read_text
+from fastapi_app.endpoints.inverted_index import (
+    document_content_hash, index_document, read_term_counts, unindex_document,
+    user_corpus_version
+)
+from fastapi_app.endpoints.jobs import make_fingerprint, start_job
+from fastapi_app.endpoints.pagination import (
+    offset_page_params, page_params, paginate, paginate_offset, stream_param, stream_rows
+)
+from fastapi_app.endpoints import bulk_upload, full_text
+from fastapi_app.endpoints.blob_storage import (
+    MAX_UPLOAD_SIZE_MB, UploadTooLarge, add_reference, new_tmp_path, release_reference
+)
+from fastapi_app.endpoints.multipart_upload import (
+    MultipartError, RequestTooLarge, iter_uploaded_files, multipart_openapi
+)
+from fastapi_app.endpoints.storage_usage import (
+    StorageQuotaExceeded, get_usage, quota_bytes, release_usage, remaining_quota, reserve_usage
+)
+from fastapi_app.endpoints.tf_cache import get_term_counts
 from main.models import UploadedFile
 from asgiref.sync import sync_to_async
 from django.core.exceptions import ObjectDoesNotExist
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
+from contextlib import aclosing
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Optional
+from urllib.parse import quote
 
-import shutil
-import uuid
-import sqlite3
 import os
-import math
-import re
-import heapq
+import json
 
 
 router = APIRouter()
-DB_PATH = os.getenv("DB_PATH")
 UPLOAD_DIR = os.getenv("UPLOAD_DIR")
-
-def get_db_connection():
-    init_db()
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+HUFFMAN_CACHE_SIZE = int(os.getenv("HUFFMAN_CACHE_SIZE", "256"))
+# Префикс internal-location в nginx (например, /internal-files/), отображённой на UPLOAD_DIR.
+# Если задан, файл отдаёт nginx через X-Accel-Redirect, а не воркер
+DOCUMENT_ACCEL_REDIRECT_PREFIX = os.getenv("DOCUMENT_ACCEL_REDIRECT_PREFIX", "")
 
 
 @router.get("/", summary="Список документов пользователя")
-def list_documents(user_id: int = Depends(get_current_user)):
+def list_documents(
+    response: Response,
+    page: tuple = Depends(page_params),
+    stream: Optional[str] = Depends(stream_param),
+    user_id: int = Depends(get_current_user),
+):
+    after_id, limit = page
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute("SELECT id, name FROM main_document WHERE user_id = ?", (user_id,))
+    if stream:
+        cursor.execute(
+            "SELECT id, name FROM main_document WHERE user_id = ? AND id > ? ORDER BY id",
+            (user_id, after_id)
+        )
+        return stream_rows(conn, cursor, stream, lambda row: {"id": row["id"], "name": row["name"]})
+
+    cursor.execute(
+        "SELECT id, name FROM main_document WHERE user_id = ? AND id > ? ORDER BY id LIMIT ?",
+        (user_id, after_id, limit + 1)
+    )
     docs = [{"id": row["id"], "name": row["name"]} for row in cursor.fetchall()]
     conn.close()
-    return docs
+    return paginate(response, docs, limit)
+
+
+@router.get("/search", summary="Полнотекстовый поиск по документам пользователя")
+def search_documents(
+    response: Response,
+    q: str = Query(..., min_length=1, max_length=500, description="Слова для поиска; слово* — поиск по префиксу"),
+    page: tuple = Depends(offset_page_params),
+    user_id: int = Depends(get_current_user),
+):
+    offset, limit = page
+    conn = get_db_connection()
+    try:
+        results = full_text.search(conn.cursor(), q, user_id, offset, limit + 1)
+    except full_text.EmptySearchQuery:
+        raise HTTPException(status_code=400, detail="В запросе нет слов для поиска")
+    finally:
+        conn.close()
+    return paginate_offset(response, results, offset, limit)
+
+
+@router.get("/storage", summary="Занятое пользователем место")
+def storage_usage(user_id: int = Depends(get_current_user)):
+    conn = get_db_connection()
+    used, documents = get_usage(conn.cursor(), user_id)
+    conn.close()
+    return {"bytes": used, "documents": documents, "quota_bytes": quota_bytes()}
 
 
 @router.get("/{document_id}", summary="Содержимое документа")
 def get_document(document_id: int, user_id: int = Depends(get_current_user)):
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute("SELECT path, user_id FROM main_document WHERE id = ?", (document_id,))
+    cursor.execute("SELECT path, user_id, encoding FROM main_document WHERE id = ?", (document_id,))
     row = cursor.fetchone()
-    conn.close()
     if not row or row["user_id"] != user_id:
+        conn.close()
         raise HTTPException(status_code=403, detail="Нет доступа")
     if not os.path.exists(row["path"]):
+        conn.close()
         raise HTTPException(status_code=404, detail="Файл отсутствует")
-    with open(row["path"], "r", encoding="utf-8") as f:
-        return {"content": f.read()}
+    encoding = document_encoding(cursor, document_id, row["path"], row["encoding"])
+    conn.commit()
+    conn.close()
+    return {"content": read_text(row["path"], encoding)}
     
 
 
-@router.get("/{document_id}/statistics", summary="TF/IDF статистика по документу")
-def document_statistics(document_id: int, user_id: int = Depends(get_current_user)):
-    def tokenize(text):
-        return re.findall(r"\b\w{2,}\b", text.lower())
+def not_modified(request: Request, etag: str, mtime: float):
+    # If-None-Match важнее If-Modified-Since (RFC 9110, 13.2.2)
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        return "*" in tags or etag in [tag[2:] if tag.startswith("W/") else tag for tag in tags]
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
 
+
+@router.api_route("/{document_id}/content", methods=["GET", "HEAD"], summary="Содержимое документа (поток, Range)")
+def get_document_content(request: Request, document_id: int, user_id: int = Depends(get_current_user)):
     conn = get_db_connection()
     cursor = conn.cursor()
-
-    # Получаем путь к текущему документу
     cursor.execute(
-        "SELECT path FROM main_document WHERE id = ? AND user_id = ?",
-        (document_id, user_id)
+        "SELECT name, path, user_id, content_hash, encoding FROM main_document WHERE id = ?",
+        (document_id,)
     )
     row = cursor.fetchone()
-    if not row:
+    if not row or row["user_id"] != user_id:
         conn.close()
-        raise HTTPException(status_code=404, detail="Документ не найден")
-
+        raise HTTPException(status_code=403, detail="Нет доступа")
     path = row["path"]
-    if not os.path.exists(path):
+    try:
+        stat_result = os.stat(path)
+    except FileNotFoundError:
         conn.close()
-        raise HTTPException(status_code=404, detail="Файл не найден")
+        raise HTTPException(status_code=404, detail="Файл отсутствует")
+    content_hash = document_content_hash(cursor, document_id, path, row["content_hash"])
+    encoding = document_encoding(cursor, document_id, path, row["encoding"])
+    conn.commit()
+    conn.close()
+
+    # Содержимое файла неизменно (блобы адресуются хэшем), поэтому ETag — хэш содержимого
+    etag = f'"{content_hash}"'
+    headers = {
+        "ETag": etag,
+        "Last-Modified": formatdate(stat_result.st_mtime, usegmt=True),
+        "Cache-Control": "private, no-cache",
+    }
+    if not_modified(request, etag, stat_result.st_mtime):
+        return Response(status_code=304, headers=headers)
+
+    charset = encoding.replace("-sig", "")
+    headers["Content-Disposition"] = f"inline; filename*=UTF-8''{quote(row['name'])}"
+    relative_path = os.path.relpath(os.path.abspath(path), os.path.abspath(UPLOAD_DIR))
+    if DOCUMENT_ACCEL_REDIRECT_PREFIX and not relative_path.startswith(".."):
+        # Range, sendfile и передачу байтов берёт на себя nginx
+        headers["X-Accel-Redirect"] = DOCUMENT_ACCEL_REDIRECT_PREFIX.rstrip("/") + "/" + quote(relative_path)
+        return Response(headers=headers, media_type=f"text/plain; charset={charset}")
+
+    # FileResponse читает файл кусками и сам обрабатывает Range / If-Range (206, 416)
+    return FileResponse(
+        path,
+        stat_result=stat_result,
+        headers=headers,
+        media_type=f"text/plain; charset={charset}",
+    )
+
+
+@router.get("/{document_id}/statistics", summary="TF/IDF статистика по документу")
+async def document_statistics(document_id: int, user_id: int = Depends(get_current_user)):
+    return await compute.run(analytics.document_statistics, document_id, user_id)
+
 
-    with open(path, "r", encoding="utf-8") as f:
-        current_text = f.read()
+@router.get("/{document_id}/similar", summary="Похожие документы пользователя (косинус TF-IDF)")
+async def similar_documents(
+    document_id: int,
+    k: int = Query(10, ge=1, le=100),
+    user_id: int = Depends(get_current_user),
+):
+    return await compute.run(analytics.similar_documents, document_id, user_id, k)
 
-    current_tokens = tokenize(current_text)
-    total_terms = len(current_tokens)
-    tf_counts = Counter(current_tokens)
 
-    # Получаем пути ко всем другим документам пользователя
+@router.post("/{document_id}/statistics/jobs", status_code=202, summary="Фоновый расчёт TF/IDF статистики по документу")
+def document_statistics_job(document_id: int, user_id: int = Depends(get_current_user)):
+    conn = get_db_connection()
+    cursor = conn.cursor()
     cursor.execute(
-        "SELECT path FROM main_document WHERE user_id = ? AND id != ?",
-        (user_id, document_id)
+        "SELECT content_hash FROM main_document WHERE id = ? AND user_id = ?",
+        (document_id, user_id)
+    )
+    row = cursor.fetchone()
+    if not row:
+        conn.close()
+        raise HTTPException(status_code=404, detail="Документ не найден")
+    # Результат зависит от содержимого документа и от DF по всем документам пользователя
+    fingerprint = make_fingerprint(
+        "document", document_id, row["content_hash"], user_corpus_version(cursor, user_id)
     )
-    other_rows = cursor.fetchall()
     conn.close()
-
-    total_docs = 1  # текущий документ
-    word_doc_occurrences = Counter()
-
-    for row in other_rows:
-        other_path = row["path"]
-        if not os.path.exists(other_path):
-            continue
-        with open(other_path, "r", encoding="utf-8") as f:
-            text = f.read()
-            tokens = set(tokenize(text))
-            word_doc_occurrences.update(tokens)
-            total_docs += 1
-
-    # Учитываем текущий документ тоже
-    for word in set(current_tokens):
-        word_doc_occurrences[word] += 1
-
-    # TF-IDF для 50 наименее частых слов (по TF)
-    tf_sorted = sorted(tf_counts.items(), key=lambda x: x[1])[:50]
-    statistics = []
-
-    for word, count in tf_sorted:
-        tf = round(count / total_terms, 6)
-        idf = round(math.log(total_docs / word_doc_occurrences[word]), 6)
-        statistics.append({
-            "word": word,
-            "tf": tf,
-            "idf": idf
-        })
-
-    return {
-        "document_id": document_id,
-        "statistics": statistics
-    }
+    return start_job(user_id, "document", document_id, fingerprint, analytics.document_statistics, document_id, user_id)
 
 
 @router.delete("/{document_id}", summary="Удалить документ")
 def delete_document(document_id: int, user_id: int = Depends(get_current_user)):
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute("SELECT path, user_id FROM main_document WHERE id = ?", (document_id,))
+    cursor.execute("SELECT path, user_id, size FROM main_document WHERE id = ?", (document_id,))
     row = cursor.fetchone()
     if not row or row["user_id"] != user_id:
         conn.close()
         raise HTTPException(status_code=403, detail="Нет доступа")
-    if os.path.exists(row["path"]):
-        os.remove(row["path"])
+    unindex_document(cursor, document_id)
+    full_text.unindex_text(cursor, [document_id])
+    release_usage(cursor, user_id, row["size"] or 0)
+    drop_huffman_tables(cursor, [document_id])
     cursor.execute("DELETE FROM main_document WHERE id = ?", (document_id,))
     cursor.execute("DELETE FROM main_collection_documents WHERE document_id = ?", (document_id,))
+    # Файл удаляется только вместе с последней ссылкой на него
+    release_reference(cursor, row["path"])
     conn.commit()
     conn.close()
     return {"message": "Документ удалён"}
 
 
-@router.post("/upload", summary="Загрузить документ")
-def upload_document(file: UploadFile = File(...), user_id: int = Depends(get_current_user)):
+def store_document(filename, tmp_path, content_hash, size, user_id):
+    # Кодировку и частоты слов (они попадают в кэш токенизации) считаем до первой записи,
+    # чтобы не держать блокировку БД
+    encoding = detect_encoding(tmp_path)
+    get_term_counts(tmp_path, content_hash, encoding, DECODE_ERRORS)
     conn = get_db_connection()
     cursor = conn.cursor()
+    try:
+        reserve_usage(cursor, user_id, size)
+        file_path = add_reference(cursor, tmp_path, content_hash, size)
+        cursor.execute(
+            "INSERT INTO main_document (name, path, user_id, content_hash, size, encoding) VALUES (?, ?, ?, ?, ?, ?)",
+            (filename, file_path, user_id, content_hash, size, encoding)
+        )
+        document_id = cursor.lastrowid
+        index_document(
+            cursor, document_id, user_id, read_term_counts(cursor, document_id, file_path, content_hash, encoding)
+        )
+        conn.commit()
+    finally:
+        conn.close()
+    full_text.index_committed(user_id, [(document_id, filename, file_path, encoding)])
+    return document_id
+
+
+@router.post("/upload", summary="Загрузить документ", openapi_extra=multipart_openapi("file"))
+async def upload_document(request: Request, user_id: int = Depends(get_current_user)):
+    # Тело читается потоково прямо в файл, одинаковое содержимое хранится на диске один раз
+    max_size = int(MAX_UPLOAD_SIZE_MB * 1024 * 1024)
+    remaining = await run_in_threadpool(remaining_quota, user_id)
+    # Приём прерывается, как только файл перестаёт помещаться в остаток квоты
+    if remaining is not None and remaining < max_size:
+        max_size = remaining
+    try:
+        async with aclosing(iter_uploaded_files(request, "file", max_size)) as files:
+            file = await anext(files, None)
+    except UploadTooLarge:
+        if max_size == remaining:
+            raise HTTPException(status_code=413, detail="Превышена квота на хранение файлов")
+        raise HTTPException(
+            status_code=413,
+            detail=f"Файл превышает допустимый размер ({MAX_UPLOAD_SIZE_MB:g} МБ)"
+        )
+    except MultipartError:
+        raise HTTPException(status_code=400, detail="Ожидается тело multipart/form-data")
+    if file is None:
+        raise HTTPException(status_code=400, detail="Файл не передан (поле file)")
 
-    # Убедимся, что директория существует
-    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    try:
+        await run_in_threadpool(store_document, file.filename, file.tmp_path, file.content_hash, file.size, user_id)
+    except StorageQuotaExceeded:
+        raise HTTPException(status_code=413, detail="Превышена квота на хранение файлов")
+    finally:
+        if os.path.exists(file.tmp_path):
+            os.remove(file.tmp_path)
 
-    # Уникальное имя файла
-    file_extension = os.path.splitext(file.filename)[1]
-    unique_filename = f"{uuid.uuid4().hex}{file_extension}"
-    file_path = os.path.join(UPLOAD_DIR, unique_filename)
+    return {"message": "Документ загружен", "filename": file.filename}
 
-    # Сохраняем файл
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
 
-    # Сохраняем запись в БД
-    cursor.execute(
-        "INSERT INTO main_document (name, path, user_id) VALUES (?, ?, ?)",
-        (file.filename, file_path, user_id)
-    )
-    conn.commit()
-    conn.close()
+@router.post(
+    "/upload/bulk",
+    summary="Загрузить много документов (несколько файлов или zip/tar-архив)",
+    openapi_extra=multipart_openapi("files", many=True),
+)
+async def upload_documents_bulk(request: Request, user_id: int = Depends(get_current_user)):
+    # Части пишутся во временный каталог по мере разбора тела, без ограничения Starlette
+    # на число файлов. Ошибка в одном файле не отменяет загрузку остальных — результат
+    # возвращается по каждому
+    max_total = int(bulk_upload.BULK_UPLOAD_MAX_TOTAL_MB * 1024 * 1024)
+    received = []
+    try:
+        async with aclosing(iter_uploaded_files(request, "files", max_total, max_total=max_total)) as files:
+            async for file in files:
+                received.append(file)
+                if len(received) > bulk_upload.BULK_UPLOAD_MAX_FILES:
+                    raise bulk_upload.TooManyFiles()
+        if not received:
+            raise HTTPException(status_code=400, detail="Файлы не переданы (поле files)")
+        results = await run_in_threadpool(bulk_upload.ingest, received, user_id)
+    except MultipartError:
+        raise HTTPException(status_code=400, detail="Ожидается тело multipart/form-data")
+    except (RequestTooLarge, UploadTooLarge):
+        raise HTTPException(
+            status_code=413,
+            detail=f"Слишком большой запрос (не более {bulk_upload.BULK_UPLOAD_MAX_TOTAL_MB:g} МБ, "
+                   f"в том числе после распаковки архивов)"
+        )
+    except bulk_upload.TooManyFiles:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Слишком много файлов в одном запросе (не более {bulk_upload.BULK_UPLOAD_MAX_FILES})"
+        )
+    finally:
+        await run_in_threadpool(bulk_upload.discard, received)
+
+    uploaded = sum(1 for result in results if result["status"] == "ok")
+    return {
+        "message": f"Загружено документов: {uploaded} из {len(results)}",
+        "uploaded": uploaded,
+        "failed": len(results) - uploaded,
+        "results": results,
+    }
 
-    return {"message": "Документ загружен", "filename": file.filename}
 
 
+huffman_cache = LRUCache(max_items=HUFFMAN_CACHE_SIZE)
 
-class HuffmanNode:
-    def __init__(self, char=None, freq=0, left=None, right=None):
-        self.char = char
-        self.freq = freq
-        self.left = left
-        self.right = right
 
-    def __lt__(self, other):
-        return self.freq < other.freq
+def cached_huffman_table(cursor, document_id, kind):
+    # Таблица (размер, длины кодов) считается один раз, хранится в БД и в ограниченном LRU-кэше
+    key = (document_id, kind)
+    table = huffman_cache.get(key)
+    if table is not None:
+        return table
 
-def build_huffman_tree(text: str):
-    if not text:
+    cursor.execute(
+        "SELECT size, lengths FROM main_document_huffman WHERE document_id = ? AND kind = ?",
+        (document_id, kind)
+    )
+    row = cursor.fetchone()
+    if not row:
         return None
-    
-    freq = Counter(text)
-    heap = [HuffmanNode(char=ch, freq=f) for ch, f in freq.items()]
-    heapq.heapify(heap)
-
-    while len(heap) > 1:
-        node1 = heapq.heappop(heap)
-        node2 = heapq.heappop(heap)
-        merged = HuffmanNode(freq=node1.freq + node2.freq, left=node1, right=node2)
-        heapq.heappush(heap, merged)
-
-    return heap[0] if heap else None
-
-def build_codes(node: HuffmanNode, prefix="", code_map=None):
-    if code_map is None:
-        code_map = {}
-    if node is None:
-        return code_map
-    if node.char is not None:
-        code_map[node.char] = prefix
-    build_codes(node.left, prefix + "0", code_map)
-    build_codes(node.right, prefix + "1", code_map)
-    return code_map
-
-def encode_text(text: str, code_map: dict) -> str:
-    return ''.join(code_map[char] for char in text)
+    table = (row["size"], dict(json.loads(row["lengths"])))
+    huffman_cache.put(key, table)
+    return table
 
-@router.get("/{document_id}/huffman")
-async def get_huffman_encoded(document_id: int, user_id: int = Depends(get_current_user)):
+
+def store_huffman_table(cursor, document_id, kind, table):
+    cursor.execute(
+        "INSERT OR REPLACE INTO main_document_huffman (document_id, kind, size, lengths) VALUES (?, ?, ?, ?)",
+        (document_id, kind, table[0], json.dumps(list(table[1].items()), ensure_ascii=False))
+    )
+    huffman_cache.put((document_id, kind), table)
+
+
+def drop_huffman_tables(cursor, document_ids):
+    for document_id in document_ids:
+        for kind in ("text", "bytes"):
+            huffman_cache.pop((document_id, kind))
+    cursor.executemany("DELETE FROM main_document_huffman WHERE document_id = ?", [(i,) for i in document_ids])
+
+
+def load_huffman_source(document_id, user_id, kind):
+    # Выборки и ленивое сохранение кодировки — в пуле потоков: запись может ждать блокировку БД
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute("SELECT path FROM main_document WHERE id = ? AND user_id = ?", (document_id, user_id))
-    row = cursor.fetchone()
-    conn.close()
-    
-    if not row:
-        raise HTTPException(status_code=404, detail="Документ не найден или нет доступа")
-    
-    path = os.path.abspath(row["path"])
-    print("Абсолютный путь:", path)
-    
-    if not os.path.exists(path):
-        raise HTTPException(status_code=404, detail="Файл не найден на диске")
-    
     try:
-        with open(path, "r", encoding="utf-8") as f:
-            content = f.read()
-    except UnicodeDecodeError:
-        raise HTTPException(status_code=400, detail="Ошибка декодирования файла (возможно, неверная кодировка)")
+        cursor.execute(
+            "SELECT name, path, encoding FROM main_document WHERE id = ? AND user_id = ?", (document_id, user_id)
+        )
+        row = cursor.fetchone()
+        if not row:
+            raise HTTPException(status_code=404, detail="Документ не найден или нет доступа")
+        path = os.path.abspath(row["path"])
+        if not os.path.exists(path):
+            raise HTTPException(status_code=404, detail="Файл не найден на диске")
+
+        encoding = row["encoding"]
+        if kind == "text" and encoding is None:
+            encoding = document_encoding(cursor, document_id, path)
+            conn.commit()
+        return row["name"], path, encoding, cached_huffman_table(cursor, document_id, kind)
+    finally:
+        conn.close()
+
 
-    root = build_huffman_tree(content)
-    if not root:
-        raise HTTPException(status_code=400, detail="Не удалось построить дерево Хаффмана (пустой файл?)")
+def save_huffman_table(document_id, kind, table):
+    conn = get_db_connection()
+    try:
+        store_huffman_table(conn.cursor(), document_id, kind, table)
+        conn.commit()
+    finally:
+        conn.close()
 
-    code_map = build_codes(root)
-    encoded = encode_text(content, code_map)
+
+@router.get("/{document_id}/huffman")
+async def get_huffman_encoded(document_id: int, user_id: int = Depends(get_current_user)):
+    _, path, encoding, table = await run_in_threadpool(load_huffman_source, document_id, user_id, "text")
+
+    # Чтение файла и кодирование выполняются в пуле процессов, а не в event loop
+    computed_table, encoded, code_map = await compute.run(
+        analytics.huffman_text, path, encoding, table[1] if table else None
+    )
+    if table is None:
+        await run_in_threadpool(save_huffman_table, document_id, "text", computed_table)
 
     return {
         "encoded_text": encoded,
         "code_table": code_map
-    }
\ No newline at end of file
+    }
+
+@router.get("/{document_id}/huffman/binary", summary="Сжатие документа кодом Хаффмана (бинарный формат)")
+async def get_huffman_binary(document_id: int, user_id: int = Depends(get_current_user)):
+    name, path, _, table = await run_in_threadpool(load_huffman_source, document_id, user_id, "bytes")
+
+    # Проход по частотам — в пуле процессов; само кодирование StreamingResponse выполняет в пуле потоков
+    if table is None:
+        table = await compute.run(analytics.byte_code_lengths, path)
+        await run_in_threadpool(save_huffman_table, document_id, "bytes", table)
+
+    original_size, lengths = table
+    filename = quote(f"{name}.huf")
+    return StreamingResponse(
+        huffman.encode_file(lambda: open(path, "rb"), original_size, lengths),
+        media_type="application/octet-stream",
+        headers={"Content-Disposition": f"attachment; filename*=UTF-8''{filename}"}
+    )
+
+
+@router.post("/huffman/decode", summary="Распаковка данных, сжатых кодом Хаффмана")
+def decode_huffman_binary(file: UploadFile = File(...), user_id: int = Depends(get_current_user)):
+    # Распаковываем во временный файл целиком: ошибка в теле (обрезанные данные, неверный код)
+    # должна дать 400, а не оборванный ответ 200
+    tmp_path = new_tmp_path()
+    try:
+        with open(tmp_path, "wb") as decoded:
+            for chunk in huffman.decode_stream(huffman.read_chunks(file.file)):
+                decoded.write(chunk)
+    except huffman.HuffmanFormatError as e:
+        os.remove(tmp_path)
+        raise HTTPException(status_code=400, detail=f"Некорректные данные: {e}")
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return FileResponse(
+        tmp_path,
+        media_type="application/octet-stream",
+        background=BackgroundTask(os.remove, tmp_path),
+    )
@@ -0,0 +1,121 @@
+import re
+
+from fastapi_app.endpoints.database import get_db_connection
+from fastapi_app.endpoints.decoding import document_encoding, read_text
+
+
+# Полнотекстовый индекс FTS5: rowid = id документа. Владелец хранится как токен "u<id>"
+# в отдельной колонке и входит в MATCH — FTS пересекает списки вхождений внутри индекса,
+# а не фильтрует совпадения всех пользователей после поиска
+FTS_TABLE = "main_document_fts"
+QUERY_TOKEN_RE = re.compile(r"\w+\*?")
+# Вес колонок в bm25: совпадение в названии важнее, колонка владельца не влияет на ранжирование
+BM25_WEIGHTS = (5.0, 1.0, 0.0)
+
+
+class EmptySearchQuery(ValueError):
+    pass
+
+
+def owner_token(user_id):
+    return f"u{user_id}"
+
+
+def build_match_query(query, user_id):
+    # Пользовательский ввод не передаём в синтаксис FTS5 как есть: каждое слово берётся
+    # в кавычки (все слова обязательны), звёздочка в конце слова — поиск по префиксу
+    terms = []
+    for token in QUERY_TOKEN_RE.findall(query):
+        word = token.rstrip("*")
+        terms.append(f'"{word}"*' if token.endswith("*") else f'"{word}"')
+    if not terms:
+        raise EmptySearchQuery()
+    # Слова ищем только в имени и тексте: столбец owner тоже проиндексирован, и запрос «u1»
+    # иначе совпал бы со всеми документами пользователя 1
+    return f'owner : "{owner_token(user_id)}" AND {{name content}} : ({" ".join(terms)})'
+
+
+def index_text(cursor, document_id, user_id, name, path, encoding=None):
+    content = read_text(path, document_encoding(cursor, document_id, path, encoding))
+    cursor.execute(
+        f"INSERT OR REPLACE INTO {FTS_TABLE} (rowid, name, content, owner) VALUES (?, ?, ?, ?)",
+        (document_id, name, content, owner_token(user_id))
+    )
+
+
+def index_committed(user_id, documents):
+    # documents — (id, имя, путь, кодировка) уже зафиксированных загрузок. Текст читается без
+    # блокировки записи, каждая вставка — своя короткая транзакция. Документ, удалённый за это
+    # время, в индекс не попадает; пропущенные строки добавляет команда backfill_search_index
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        for document_id, name, path, encoding in documents:
+            try:
+                content = read_text(path, encoding)
+            except FileNotFoundError:
+                continue
+            cursor.execute(f"""
+                INSERT OR REPLACE INTO {FTS_TABLE} (rowid, name, content, owner)
+                SELECT ?, ?, ?, ? WHERE EXISTS (SELECT 1 FROM main_document WHERE id = ?)
+            """, (document_id, name, content, owner_token(user_id), document_id))
+            conn.commit()
+    finally:
+        conn.close()
+
+
+def unindex_text(cursor, document_ids):
+    cursor.executemany(f"DELETE FROM {FTS_TABLE} WHERE rowid = ?", [(i,) for i in document_ids])
+
+
+def unindex_user_text(cursor, user_id):
+    cursor.execute(
+        f"DELETE FROM {FTS_TABLE} WHERE rowid IN (SELECT id FROM main_document WHERE user_id = ?)",
+        (user_id,)
+    )
+
+
+def search(cursor, query, user_id, offset, limit):
+    cursor.execute(f"""
+        SELECT rowid AS id, name,
+               snippet({FTS_TABLE}, 1, '<mark>', '</mark>', '…', 24) AS snippet,
+               bm25({FTS_TABLE}, ?, ?, ?) AS score
+        FROM {FTS_TABLE}
+        WHERE {FTS_TABLE} MATCH ?
+        ORDER BY score
+        LIMIT ? OFFSET ?
+    """, (*BM25_WEIGHTS, build_match_query(query, user_id), limit, offset))
+    # bm25 в SQLite отрицателен (меньше — лучше), наружу отдаём положительную релевантность
+    return [
+        {"id": row["id"], "name": row["name"], "snippet": row["snippet"], "score": round(-row["score"], 6)}
+        for row in cursor.fetchall()
+    ]
+
+
+def backfill(conn, batch_size=500, rebuild=False):
+    cursor = conn.cursor()
+    if rebuild:
+        cursor.execute(f"DELETE FROM {FTS_TABLE}")
+        conn.commit()
+
+    indexed = 0
+    last_id = 0
+    while True:
+        # Пачками, с commit после каждой — блокировка записи не держится на весь проход
+        cursor.execute(f"""
+            SELECT id, user_id, name, path, encoding FROM main_document
+            WHERE id > ? AND id NOT IN (SELECT rowid FROM {FTS_TABLE})
+            ORDER BY id LIMIT ?
+        """, (last_id, batch_size))
+        rows = cursor.fetchall()
+        if not rows:
+            break
+        for row in rows:
+            try:
+                index_text(cursor, row["id"], row["user_id"], row["name"], row["path"], row["encoding"])
+                indexed += 1
+            except FileNotFoundError:
+                pass
+        conn.commit()
+        last_id = rows[-1]["id"]
+    return indexed
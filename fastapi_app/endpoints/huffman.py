@@ -0,0 +1,244 @@
+import heapq
+import struct
+from collections import Counter
+
+
+# Формат: MAGIC | длина исходных данных (u64) | число символов (u16) | пары (байт, длина кода) | упакованные биты
+MAGIC = b"HUF1"
+HEADER = struct.Struct(">4sQH")
+CHUNK_SIZE = 64 * 1024
+
+
+class HuffmanFormatError(ValueError):
+    pass
+
+
+def read_chunks(f, chunk_size=CHUNK_SIZE):
+    return iter(lambda: f.read(chunk_size), b"")
+
+
+def byte_frequencies(chunks):
+    freq = Counter()
+    for chunk in chunks:
+        freq.update(chunk)
+    return freq
+
+
+def code_lengths(freq):
+    # Длины кодов по частотам: дерево хранится массивом родителей, без объектов-узлов.
+    # Символами могут быть и байты (int), и символы текста (str)
+    symbols = [symbol for symbol, count in freq.items() if count]
+    if not symbols:
+        return {}
+    if len(symbols) == 1:
+        return {symbols[0]: 1}
+
+    parent = [-1] * len(symbols)
+    heap = [(freq[symbol], index) for index, symbol in enumerate(symbols)]
+    heapq.heapify(heap)
+    while len(heap) > 1:
+        weight1, node1 = heapq.heappop(heap)
+        weight2, node2 = heapq.heappop(heap)
+        merged = len(parent)
+        parent.append(-1)
+        parent[node1] = merged
+        parent[node2] = merged
+        heapq.heappush(heap, (weight1 + weight2, merged))
+
+    # Глубину считаем сверху вниз: родитель всегда создан позже потомка
+    depth = [0] * len(parent)
+    for node in range(len(parent) - 2, -1, -1):
+        depth[node] = depth[parent[node]] + 1
+    return {symbol: depth[index] for index, symbol in enumerate(symbols)}
+
+
+def canonical_codes(lengths):
+    # Канонические коды: символы упорядочены по (длина, значение), коды идут подряд
+    codes = {}
+    code = 0
+    previous_length = 0
+    for symbol, length in sorted(lengths.items(), key=lambda item: (item[1], item[0])):
+        code <<= length - previous_length
+        codes[symbol] = (code, length)
+        code += 1
+        previous_length = length
+    return codes
+
+
+def encode_header(original_size, lengths):
+    header = bytearray(HEADER.pack(MAGIC, original_size, len(lengths)))
+    for symbol in sorted(lengths):
+        header += bytes((symbol, lengths[symbol]))
+    return bytes(header)
+
+
+def decode_header(data):
+    if len(data) < HEADER.size:
+        raise HuffmanFormatError("Слишком короткий заголовок")
+    magic, original_size, symbol_count = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise HuffmanFormatError("Неизвестный формат")
+    table_end = HEADER.size + 2 * symbol_count
+    if len(data) < table_end:
+        raise HuffmanFormatError("Повреждённая таблица кодов")
+    table = data[HEADER.size:table_end]
+    lengths = {table[i]: table[i + 1] for i in range(0, len(table), 2)}
+    if len(lengths) != symbol_count or (original_size and not lengths):
+        raise HuffmanFormatError("Повреждённая таблица кодов")
+    validate_code_lengths(lengths)
+    return original_size, lengths, table_end
+
+
+def validate_code_lengths(lengths):
+    # Длины должны задавать префиксный код (неравенство Крафта: сумма 2^-длина <= 1),
+    # иначе канонические коды пересекаются. Глубина дерева Хаффмана не больше числа символов - 1,
+    # единственный символ кодируется одним битом
+    if not lengths:
+        return
+    max_length = max(1, len(lengths) - 1)
+    if any(length == 0 or length > max_length for length in lengths.values()):
+        raise HuffmanFormatError("Недопустимая длина кода")
+    if len(lengths) == 1 and next(iter(lengths.values())) != 1:
+        raise HuffmanFormatError("Недопустимая длина кода")
+    longest = max(lengths.values())
+    if sum(1 << (longest - length) for length in lengths.values()) > 1 << longest:
+        raise HuffmanFormatError("Коды таблицы пересекаются")
+
+
+def encode_chunks(chunks, lengths):
+    # Биты накапливаются строкой '0'/'1' только в пределах одного куска входных данных
+    code_strings = [""] * 256
+    for symbol, code in code_map(lengths).items():
+        code_strings[symbol] = code
+
+    pending = ""
+    for chunk in chunks:
+        bits = pending + "".join(map(code_strings.__getitem__, chunk))
+        full = len(bits) - len(bits) % 8
+        if full:
+            yield int(bits[:full], 2).to_bytes(full // 8, "big")
+        pending = bits[full:]
+    if pending:
+        yield int(pending.ljust(8, "0"), 2).to_bytes(1, "big")
+
+
+def file_code_lengths(open_file, chunk_size=CHUNK_SIZE):
+    with open_file() as f:
+        freq = byte_frequencies(read_chunks(f, chunk_size))
+    return sum(freq.values()), code_lengths(freq)
+
+
+def encode_file(open_file, original_size, lengths, chunk_size=CHUNK_SIZE):
+    yield encode_header(original_size, lengths)
+    with open_file() as f:
+        yield from encode_chunks(read_chunks(f, chunk_size), lengths)
+
+
+def encode_stream(open_file, chunk_size=CHUNK_SIZE):
+    # Два прохода по файлу: подсчёт частот и кодирование; в памяти только один кусок
+    original_size, lengths = file_code_lengths(open_file, chunk_size)
+    yield from encode_file(open_file, original_size, lengths, chunk_size)
+
+
+def code_map(lengths):
+    return {symbol: format(code, f"0{length}b") for symbol, (code, length) in canonical_codes(lengths).items()}
+
+
+class ByteDecoder:
+    # Табличный канонический декодер: состояние — внутренний узел дерева кодов, переход
+    # по целому входному байту сразу даёт все символы, закончившиеся в этом байте, и новое состояние.
+    # Переходы считаются лениво, при первом появлении пары (состояние, байт)
+    INVALID = -1
+
+    def __init__(self, lengths):
+        # Дерево по каноническим кодам: children[узел] = [потомок по 0, потомок по 1];
+        # лист кодируется как -(символ + 2), отсутствующая ветвь — None
+        self.children = [[None, None]]
+        for symbol, (code, length) in canonical_codes(lengths).items():
+            node = 0
+            for shift in range(length - 1, 0, -1):
+                bit = (code >> shift) & 1
+                if self.children[node][bit] is None:
+                    self.children[node][bit] = len(self.children)
+                    self.children.append([None, None])
+                node = self.children[node][bit]
+            self.children[node][code & 1] = -(symbol + 2)
+        self.table = [[None] * 256 for _ in self.children]
+
+    def step(self, state, byte):
+        out = bytearray()
+        node = state
+        for shift in range(7, -1, -1):
+            node = self.children[node][(byte >> shift) & 1]
+            if node is None:
+                return bytes(out), self.INVALID
+            if node < 0:
+                out.append(-node - 2)
+                node = 0
+        return bytes(out), node
+
+    def decode(self, chunks, original_size):
+        table = self.table
+        remaining = original_size
+        state = 0
+        for chunk in chunks:
+            if not remaining:
+                break
+            out = bytearray()
+            for byte in chunk:
+                transition = table[state][byte]
+                if transition is None:
+                    transition = table[state][byte] = self.step(state, byte)
+                symbols, state = transition
+                out += symbols
+                if state == self.INVALID:
+                    break
+            # Лишние символы из битов выравнивания в последнем байте отбрасываются, не проверяя их
+            if len(out) >= remaining:
+                yield bytes(out[:remaining])
+                remaining = 0
+                break
+            if state == self.INVALID:
+                raise HuffmanFormatError("Недопустимый код")
+            remaining -= len(out)
+            yield bytes(out)
+        if remaining:
+            raise HuffmanFormatError("Данные обрываются раньше конца")
+
+
+def decode_chunks(chunks, original_size, lengths):
+    return ByteDecoder(lengths).decode(chunks, original_size)
+
+
+def decode_stream(chunks):
+    # Заголовок разбирается сразу, чтобы ошибки формата были видны до начала потоковой выдачи
+    chunks = iter(chunks)
+    buffer = bytearray()
+
+    def fill(size):
+        while len(buffer) < size:
+            chunk = next(chunks, b"")
+            if not chunk:
+                raise HuffmanFormatError("Слишком короткий заголовок")
+            buffer.extend(chunk)
+
+    fill(HEADER.size)
+    _, _, symbol_count = HEADER.unpack_from(buffer)
+    fill(HEADER.size + 2 * symbol_count)
+    original_size, lengths, table_end = decode_header(bytes(buffer))
+
+    def body():
+        if table_end < len(buffer):
+            yield bytes(buffer[table_end:])
+        yield from chunks
+
+    return decode_chunks(body(), original_size, lengths)
+
+
+def encode_bytes(data):
+    lengths = code_lengths(Counter(data))
+    return encode_header(len(data), lengths) + b"".join(encode_chunks([data], lengths))
+
+
+def decode_bytes(data):
+    return b"".join(decode_stream([data]))
@@ -0,0 +1,174 @@
+import os
+from collections import Counter
+from itertools import repeat
+
+from fastapi_app.endpoints.decoding import DECODE_ERRORS, document_encoding
+from fastapi_app.endpoints.tf_cache import file_hash, get_term_counts
+
+
+def document_content_hash(cursor, document_id, path, content_hash=None):
+    # Для документов без сохранённого хэша считаем его один раз и запоминаем
+    if content_hash is None:
+        content_hash = file_hash(path)
+        cursor.execute("UPDATE main_document SET content_hash = ? WHERE id = ?", (content_hash, document_id))
+    return content_hash
+
+
+def read_term_counts(cursor, document_id, path, content_hash=None, encoding=None):
+    return get_term_counts(
+        path,
+        document_content_hash(cursor, document_id, path, content_hash),
+        document_encoding(cursor, document_id, path, encoding),
+        DECODE_ERRORS,
+    )
+
+
+def index_document(cursor, document_id, user_id, term_counts):
+    # Документ уже проиндексирован — повторно DF не увеличиваем
+    cursor.execute(
+        "INSERT OR IGNORE INTO main_document_index (document_id, user_id, total_terms) VALUES (?, ?, ?)",
+        (document_id, user_id, term_counts.total)
+    )
+    if cursor.rowcount == 0:
+        return
+
+    cursor.executemany(
+        "INSERT INTO main_document_terms (document_id, term, count) VALUES (?, ?, ?)",
+        [(document_id, term, count) for term, count in term_counts.items()]
+    )
+    cursor.executemany("""
+        INSERT INTO main_term_df (user_id, term, doc_count) VALUES (?, ?, 1)
+        ON CONFLICT(user_id, term) DO UPDATE SET doc_count = doc_count + 1
+    """, [(user_id, term) for term in term_counts.terms()])
+    cursor.execute("""
+        INSERT INTO main_user_corpus (user_id, doc_count, version) VALUES (?, 1, 1)
+        ON CONFLICT(user_id) DO UPDATE SET doc_count = doc_count + 1, version = version + 1
+    """, (user_id,))
+
+
+def index_new_documents(cursor, user_id, documents):
+    # Массовая индексация только что добавленных документов: пары (id, частоты) читаются
+    # по одной, строки всех документов уходят в базу несколькими executemany
+    totals = []
+    document_frequency = Counter()
+
+    def term_rows():
+        for document_id, term_counts in documents:
+            terms = term_counts.terms()
+            totals.append((document_id, user_id, term_counts.total))
+            document_frequency.update(terms)
+            yield from zip(repeat(document_id), terms, term_counts.counts.tolist())
+
+    cursor.executemany("INSERT INTO main_document_terms (document_id, term, count) VALUES (?, ?, ?)", term_rows())
+    if not totals:
+        return
+    cursor.executemany(
+        "INSERT INTO main_document_index (document_id, user_id, total_terms) VALUES (?, ?, ?)", totals
+    )
+    cursor.executemany("""
+        INSERT INTO main_term_df (user_id, term, doc_count) VALUES (?, ?, ?)
+        ON CONFLICT(user_id, term) DO UPDATE SET doc_count = doc_count + excluded.doc_count
+    """, [(user_id, term, count) for term, count in document_frequency.items()])
+    cursor.execute("""
+        INSERT INTO main_user_corpus (user_id, doc_count, version) VALUES (?, ?, 1)
+        ON CONFLICT(user_id) DO UPDATE SET doc_count = doc_count + excluded.doc_count, version = version + 1
+    """, (user_id, len(totals)))
+
+
+def unindex_document(cursor, document_id):
+    cursor.execute("SELECT user_id FROM main_document_index WHERE document_id = ?", (document_id,))
+    row = cursor.fetchone()
+    if not row:
+        return
+    user_id = row[0]
+
+    terms_of_document = "SELECT term FROM main_document_terms WHERE document_id = ?"
+    cursor.execute(
+        f"UPDATE main_term_df SET doc_count = doc_count - 1 WHERE user_id = ? AND term IN ({terms_of_document})",
+        (user_id, document_id)
+    )
+    cursor.execute(
+        f"DELETE FROM main_term_df WHERE user_id = ? AND doc_count <= 0 AND term IN ({terms_of_document})",
+        (user_id, document_id)
+    )
+    cursor.execute("DELETE FROM main_document_terms WHERE document_id = ?", (document_id,))
+    cursor.execute("DELETE FROM main_document_index WHERE document_id = ?", (document_id,))
+    cursor.execute(
+        "UPDATE main_user_corpus SET doc_count = doc_count - 1, version = version + 1 WHERE user_id = ?",
+        (user_id,)
+    )
+
+
+def unindex_user(cursor, user_id):
+    cursor.execute(
+        "DELETE FROM main_document_terms WHERE document_id IN "
+        "(SELECT document_id FROM main_document_index WHERE user_id = ?)",
+        (user_id,)
+    )
+    cursor.execute("DELETE FROM main_document_index WHERE user_id = ?", (user_id,))
+    cursor.execute("DELETE FROM main_term_df WHERE user_id = ?", (user_id,))
+    cursor.execute("DELETE FROM main_user_corpus WHERE user_id = ?", (user_id,))
+
+
+def ensure_indexed(cursor, document_id, user_id, path, content_hash=None, encoding=None):
+    # Документы, загруженные до появления индекса, индексируем при первом обращении
+    cursor.execute("SELECT 1 FROM main_document_index WHERE document_id = ?", (document_id,))
+    if cursor.fetchone():
+        return True
+    if not os.path.exists(path):
+        return False
+    index_document(cursor, document_id, user_id, read_term_counts(cursor, document_id, path, content_hash, encoding))
+    return True
+
+
+def ensure_user_indexed(cursor, user_id):
+    # IDF считается по всем документам пользователя, поэтому перед чтением DF индексируем
+    # все его документы, загруженные до появления индекса, а не только запрошенный
+    cursor.execute("""
+        SELECT d.id, d.path, d.content_hash, d.encoding
+        FROM main_document d
+        LEFT JOIN main_document_index i ON i.document_id = d.id
+        WHERE d.user_id = ? AND i.document_id IS NULL
+    """, (user_id,))
+    indexed = 0
+    for document_id, path, content_hash, encoding in cursor.fetchall():
+        if not os.path.exists(path):
+            continue
+        index_document(cursor, document_id, user_id, read_term_counts(cursor, document_id, path, content_hash, encoding))
+        indexed += 1
+    return indexed
+
+
+def user_document_count(cursor, user_id):
+    cursor.execute("SELECT doc_count FROM main_user_corpus WHERE user_id = ?", (user_id,))
+    row = cursor.fetchone()
+    return row[0] if row else 0
+
+
+def user_corpus_version(cursor, user_id):
+    # Меняется при каждом изменении набора проиндексированных документов пользователя
+    cursor.execute("SELECT version FROM main_user_corpus WHERE user_id = ?", (user_id,))
+    row = cursor.fetchone()
+    return row[0] if row else 0
+
+
+def rebuild_index(conn):
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM main_document_terms")
+    cursor.execute("DELETE FROM main_document_index")
+    cursor.execute("DELETE FROM main_term_df")
+    # Версии не сбрасываем, чтобы сохранённые результаты аналитики не совпали с новыми данными
+    cursor.execute("UPDATE main_user_corpus SET doc_count = 0, version = version + 1")
+
+    indexed = 0
+    rows = conn.execute("SELECT id, user_id, path, content_hash, encoding FROM main_document ORDER BY id").fetchall()
+    for document_id, user_id, path, content_hash, encoding in rows:
+        if not os.path.exists(path):
+            continue
+        index_document(
+            cursor, document_id, user_id, read_term_counts(cursor, document_id, path, content_hash, encoding)
+        )
+        indexed += 1
+
+    conn.commit()
+    return indexed
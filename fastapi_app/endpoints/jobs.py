@@ -0,0 +1,169 @@
+from fastapi import APIRouter, HTTPException, Depends
+from starlette.concurrency import run_in_threadpool
+from fastapi_app.endpoints.auth import get_current_user
+from fastapi_app.endpoints.database import get_db_connection
+from fastapi_app.endpoints.analytics import AnalyticsError
+from fastapi_app.endpoints import compute
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+ANALYTICS_JOB_TTL_SECONDS = int(os.getenv("ANALYTICS_JOB_TTL_SECONDS", "3600"))
+# Процесс, запустивший задачу, периодически отмечает её heartbeat_at, пока ждёт результата.
+# Задача без отметки дольше ANALYTICS_JOB_STALE_SECONDS потеряна (процесс перезапущен или упал);
+# долгие и ждущие в очереди пула задачи отметки получают и потерянными не считаются
+ANALYTICS_JOB_HEARTBEAT_SECONDS = float(os.getenv("ANALYTICS_JOB_HEARTBEAT_SECONDS", "15"))
+ANALYTICS_JOB_STALE_SECONDS = float(os.getenv("ANALYTICS_JOB_STALE_SECONDS", "60"))
+STALE_JOB_ERROR = "Задача прервана (перезапуск или сбой сервера), запустите её заново"
+
+# Задачи этого процесса, которые ещё выполняются
+_running = set()
+_running_lock = threading.Lock()
+
+
+def is_stale(row, now):
+    return row["status"] == "running" and (row["heartbeat_at"] or row["created_at"]) < now - ANALYTICS_JOB_STALE_SECONDS
+
+
+def make_fingerprint(*parts):
+    return hashlib.sha256(":".join(str(part) for part in parts).encode()).hexdigest()
+
+
+def finish_job(job_id, future):
+    # Вызывается в потоке пула процессов по завершении задачи
+    with _running_lock:
+        _running.discard(job_id)
+    status, result, error, error_code = "done", None, None, None
+    try:
+        result = json.dumps(future.result(), ensure_ascii=False)
+    except AnalyticsError as e:
+        status, error, error_code = "failed", e.detail, e.status_code
+    except Exception as e:
+        status, error, error_code = "failed", str(e) or type(e).__name__, 500
+
+    conn = get_db_connection()
+    conn.execute(
+        "UPDATE main_analytics_job SET status = ?, result = ?, error = ?, error_code = ? WHERE id = ?",
+        (status, result, error, error_code, job_id)
+    )
+    conn.commit()
+    conn.close()
+
+
+def start_job(user_id, kind, target_id, fingerprint, fn, *args):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    now = time.time()
+    cursor.execute("DELETE FROM main_analytics_job WHERE expires_at < ?", (now,))
+
+    # Те же входные данные — отдаём уже посчитанную (или считающуюся) задачу;
+    # потерянные (без отметки heartbeat) не переиспользуем
+    cursor.execute("""
+        SELECT id, status FROM main_analytics_job
+        WHERE user_id = ? AND fingerprint = ? AND status != 'failed'
+            AND NOT (status = 'running' AND COALESCE(heartbeat_at, created_at) < ?)
+        ORDER BY created_at DESC LIMIT 1
+    """, (user_id, fingerprint, now - ANALYTICS_JOB_STALE_SECONDS))
+    row = cursor.fetchone()
+    if row:
+        conn.commit()
+        conn.close()
+        return {"job_id": row["id"], "status": row["status"]}
+
+    job_id = uuid.uuid4().hex
+    cursor.execute("""
+        INSERT INTO main_analytics_job (
+            id, user_id, kind, target_id, fingerprint, status, created_at, heartbeat_at, expires_at
+        )
+        VALUES (?, ?, ?, ?, ?, 'running', ?, ?, ?)
+    """, (job_id, user_id, kind, target_id, fingerprint, now, now, now + ANALYTICS_JOB_TTL_SECONDS))
+    conn.commit()
+
+    try:
+        future = compute.submit(fn, *args)
+    except compute.ComputeSaturated:
+        cursor.execute("DELETE FROM main_analytics_job WHERE id = ?", (job_id,))
+        conn.commit()
+        conn.close()
+        raise
+    conn.close()
+    with _running_lock:
+        _running.add(job_id)
+    future.add_done_callback(lambda f: finish_job(job_id, f))
+    return {"job_id": job_id, "status": "running"}
+
+
+def touch_running_jobs():
+    with _running_lock:
+        job_ids = list(_running)
+    if not job_ids:
+        return
+    conn = get_db_connection()
+    conn.execute(
+        "UPDATE main_analytics_job SET heartbeat_at = ? "
+        "WHERE status = 'running' AND id IN (SELECT value FROM json_each(?))",
+        (time.time(), json.dumps(job_ids))
+    )
+    conn.commit()
+    conn.close()
+
+
+class JobHeartbeat:
+    def __init__(self):
+        self.task = None
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(ANALYTICS_JOB_HEARTBEAT_SECONDS)
+            try:
+                await run_in_threadpool(touch_running_jobs)
+            except Exception:
+                logger.exception("Не удалось обновить отметки фоновых задач")
+
+    def start(self):
+        self.task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+
+heartbeat = JobHeartbeat()
+
+
+@router.get("/{job_id}", summary="Статус и результат задачи аналитики")
+def get_job(job_id: str, user_id: int = Depends(get_current_user)):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    now = time.time()
+    cursor.execute(
+        "SELECT * FROM main_analytics_job WHERE id = ? AND user_id = ? AND expires_at >= ?",
+        (job_id, user_id, now)
+    )
+    row = cursor.fetchone()
+    conn.close()
+    if not row:
+        raise HTTPException(status_code=404, detail="Задача не найдена")
+
+    job = {"job_id": row["id"], "kind": row["kind"], "target_id": row["target_id"], "status": row["status"]}
+    if is_stale(row, now):
+        job["status"] = "failed"
+        job["error"] = {"status_code": 500, "detail": STALE_JOB_ERROR}
+    elif row["status"] == "done":
+        job["result"] = json.loads(row["result"])
+    elif row["status"] == "failed":
+        job["error"] = {"status_code": row["error_code"], "detail": row["error"]}
+    return job
@@ -0,0 +1,272 @@
+import bisect
+import math
+import time
+
+from django.urls import Resolver404, resolve
+from starlette.routing import Match, Mount
+
+
+# Метрики обновляются только из MetricsMiddleware, то есть из одного потока event loop,
+# поэтому блокировки не нужны. Чтение снимка из другого потока видит согласованные
+# значения отдельных счётчиков (атомарность операций под GIL).
+
+WINDOW_SECONDS = 300
+
+# Границы корзин для экспорта в Prometheus (le), как у стандартных клиентских библиотек
+PROMETHEUS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class LatencyHistogram:
+    # Лог-линейные корзины в духе HDR Histogram: SUB_BUCKETS корзин на каждую степень двойки,
+    # относительная погрешность квантилей не больше 1 / SUB_BUCKETS
+    SUB_BUCKETS = 16
+    MIN_EXPONENT = -14   # 2**-14 с ≈ 61 мкс
+    MAX_EXPONENT = 7     # 2**7 с = 128 с
+
+    def __init__(self):
+        self.counts = [0] * ((self.MAX_EXPONENT - self.MIN_EXPONENT) * self.SUB_BUCKETS + 2)
+        self.export_counts = [0] * (len(PROMETHEUS_BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def bucket_index(self, seconds):
+        if seconds <= 0:
+            return 0
+        mantissa, exponent = math.frexp(seconds)  # seconds = mantissa * 2**exponent, mantissa в [0.5, 1)
+        if exponent <= self.MIN_EXPONENT:
+            return 0
+        if exponent > self.MAX_EXPONENT:
+            return len(self.counts) - 1
+        sub_bucket = int((mantissa - 0.5) * 2 * self.SUB_BUCKETS)
+        return 1 + (exponent - self.MIN_EXPONENT - 1) * self.SUB_BUCKETS + sub_bucket
+
+    def bucket_upper_bound(self, index):
+        if index == 0:
+            return 2.0 ** self.MIN_EXPONENT
+        if index >= len(self.counts) - 1:
+            return math.inf
+        exponent, sub_bucket = divmod(index - 1, self.SUB_BUCKETS)
+        return 2.0 ** (exponent + self.MIN_EXPONENT) * (1 + (sub_bucket + 1) / self.SUB_BUCKETS)
+
+    def record(self, seconds):
+        self.counts[self.bucket_index(seconds)] += 1
+        self.export_counts[bisect.bisect_left(PROMETHEUS_BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, q, counts=None, count=None):
+        counts = self.counts if counts is None else counts
+        count = self.count if count is None else count
+        if not count:
+            return 0.0
+        rank = math.ceil(q * count)
+        seen = 0
+        for index, bucket_count in enumerate(counts):
+            seen += bucket_count
+            if seen >= rank:
+                return min(self.bucket_upper_bound(index), self.max)
+        return self.max
+
+    def snapshot(self):
+        counts = list(self.counts)
+        count = sum(counts)
+        return {
+            "count": count,
+            "avg": round(self.total / count, 6) if count else 0,
+            "p50": round(self.percentile(0.50, counts, count), 6),
+            "p95": round(self.percentile(0.95, counts, count), 6),
+            "p99": round(self.percentile(0.99, counts, count), 6),
+            "max": round(self.max, 6),
+        }
+
+
+class SlidingWindowCounter:
+    # Кольцевой буфер посекундных корзин вместо очереди отметок времени
+    def __init__(self, window_seconds=WINDOW_SECONDS):
+        self.window_seconds = window_seconds
+        self.counts = [0] * window_seconds
+        self.seconds = [-1] * window_seconds
+
+    def add(self, now=None, amount=1):
+        second = int(time.time() if now is None else now)
+        index = second % self.window_seconds
+        if self.seconds[index] != second:
+            self.seconds[index] = second
+            self.counts[index] = 0
+        self.counts[index] += amount
+
+    def total(self, now=None):
+        oldest = int(time.time() if now is None else now) - self.window_seconds
+        return sum(count for second, count in zip(list(self.seconds), list(self.counts)) if second > oldest)
+
+
+class RouteStats:
+    __slots__ = ("latency", "statuses", "errors")
+
+    def __init__(self):
+        self.latency = LatencyHistogram()
+        self.statuses = {}
+        self.errors = 0
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.latency = LatencyHistogram()
+        self.window = SlidingWindowCounter()
+        self.routes = {}
+        self.in_progress = {}
+
+    def started(self, app_name):
+        self.in_progress[app_name] = self.in_progress.get(app_name, 0) + 1
+
+    def finished(self, app_name):
+        self.in_progress[app_name] -= 1
+
+    def record(self, route, status_code, seconds):
+        stats = self.routes.get(route)
+        if stats is None:
+            stats = self.routes[route] = RouteStats()
+        stats.latency.record(seconds)
+        stats.statuses[status_code] = stats.statuses.get(status_code, 0) + 1
+        if status_code >= 500:
+            stats.errors += 1
+        self.latency.record(seconds)
+        self.window.add()
+
+    def snapshot(self):
+        total = self.latency.snapshot()
+        return {
+            "avg_response_time": round(total["avg"], 4),
+            "request_count_last_5min": self.window.total(),
+            "latency": total,
+            "in_progress": dict(self.in_progress),
+            "routes": {
+                route: dict(stats.latency.snapshot(), errors=stats.errors)
+                for route, stats in list(self.routes.items())
+            },
+        }
+
+
+registry = MetricsRegistry()
+
+
+def route_template(scope):
+    # Шаблон маршрута (/api/documents/{document_id}), а не конкретный путь — число меток ограничено
+    route = scope.get("route")
+    path = getattr(route, "path", None)
+    # Mount остаётся в scope, если внутри смонтированного приложения маршрут не нашёлся
+    if path is None or isinstance(route, Mount):
+        return None
+    # Новые версии FastAPI подключают роутеры без копирования маршрутов, префикс хранится отдельно
+    included_router = scope.get("fastapi", {}).get("included_router")
+    include_context = getattr(included_router, "include_context", None)
+    return scope.get("root_path", "") + getattr(include_context, "prefix", "") + path
+
+
+def django_route_template(path):
+    try:
+        match = resolve(path)
+    except Resolver404:
+        return None
+    return "/" + match.route
+
+
+class MetricsMiddleware:
+    # Чистый ASGI middleware на внешнем приложении: видит запросы и FastAPI, и Django
+    def __init__(self, app, mounts):
+        self.app = app
+        self.mounts = mounts
+
+    def mount_name(self, scope):
+        for name, mount in self.mounts.items():
+            match, _ = mount.matches(scope)
+            if match != Match.NONE:
+                return name
+        return "unmatched"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        app_name = self.mount_name(scope)
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        registry.started(app_name)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            duration = time.perf_counter() - start
+            registry.finished(app_name)
+            route = route_template(scope)
+            if route is None and app_name == "django":
+                route = django_route_template(scope["path"])
+            registry.record(route or "unmatched", status_code, duration)
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_prometheus(registry, gauges=()):
+    lines = [
+        "# HELP http_requests_total Количество HTTP-запросов",
+        "# TYPE http_requests_total counter",
+    ]
+    routes = sorted(list(registry.routes.items()))
+    for route, stats in routes:
+        for status_code, count in sorted(list(stats.statuses.items())):
+            lines.append(f'http_requests_total{{route="{escape_label(route)}",status="{status_code}"}} {count}')
+
+    lines += [
+        "# HELP http_request_errors_total Количество ответов 5xx и необработанных исключений",
+        "# TYPE http_request_errors_total counter",
+    ]
+    for route, stats in routes:
+        lines.append(f'http_request_errors_total{{route="{escape_label(route)}"}} {stats.errors}')
+
+    lines += [
+        "# HELP http_request_duration_seconds Время обработки HTTP-запроса",
+        "# TYPE http_request_duration_seconds histogram",
+    ]
+    for route, stats in routes:
+        label = escape_label(route)
+        latency = stats.latency
+        cumulative = 0
+        for bound, count in zip(PROMETHEUS_BUCKETS + (math.inf,), list(latency.export_counts)):
+            cumulative += count
+            lines.append(f'http_request_duration_seconds_bucket{{route="{label}",le="{format_value(bound)}"}} {cumulative}')
+        lines.append(f'http_request_duration_seconds_sum{{route="{label}"}} {format_value(latency.total)}')
+        lines.append(f'http_request_duration_seconds_count{{route="{label}"}} {cumulative}')
+
+    lines += [
+        "# HELP http_requests_in_progress Запросы в обработке",
+        "# TYPE http_requests_in_progress gauge",
+    ]
+    for app_name, count in sorted(list(registry.in_progress.items())):
+        lines.append(f'http_requests_in_progress{{app="{escape_label(app_name)}"}} {count}')
+
+    for name, help_text, value in gauges:
+        lines += [
+            f"# HELP {name} {help_text}",
+            f"# TYPE {name} gauge",
+            f"{name} {format_value(value)}",
+        ]
+    return "\n".join(lines) + "\n"
+
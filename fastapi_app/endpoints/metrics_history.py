@@ -0,0 +1,190 @@
+from fastapi import APIRouter, HTTPException, Query
+from fastapi_app.endpoints.database import get_db_connection
+from fastapi_app.endpoints import compute, metrics, tf_cache
+from starlette.concurrency import run_in_threadpool
+from typing import Optional
+import asyncio
+import logging
+import os
+import time
+
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+
+METRICS_SAMPLE_INTERVAL_SECONDS = int(os.getenv("METRICS_SAMPLE_INTERVAL_SECONDS", "10"))
+METRICS_FLUSH_BATCH = int(os.getenv("METRICS_FLUSH_BATCH", "6"))
+METRICS_RAW_RETENTION_HOURS = int(os.getenv("METRICS_RAW_RETENTION_HOURS", "24"))
+METRICS_RETENTION_DAYS = int(os.getenv("METRICS_RETENTION_DAYS", "30"))
+
+DOWNSAMPLED_RESOLUTION = 3600
+MAX_POINTS = 11000
+
+SERIES = (
+    "requests_per_second",
+    "errors_per_second",
+    "latency_avg",
+    "latency_p50",
+    "latency_p95",
+    "latency_p99",
+    "requests_in_progress",
+    "tf_cache_memory_bytes",
+    "compute_available_slots",
+)
+
+
+class Sampler:
+    # Счётчики в реестре накопительные, в историю пишем значения за интервал между снимками
+    def __init__(self, registry):
+        self.registry = registry
+        self.previous_counts = list(registry.latency.counts)
+        self.previous_total = registry.latency.total
+        self.previous_errors = self.error_count()
+
+    def error_count(self):
+        return sum(stats.errors for stats in list(self.registry.routes.values()))
+
+    def sample(self, interval):
+        latency = self.registry.latency
+        counts = list(latency.counts)
+        total = latency.total
+        errors = self.error_count()
+
+        delta_counts = [current - previous for current, previous in zip(counts, self.previous_counts)]
+        delta_count = sum(delta_counts)
+        values = {
+            "requests_per_second": delta_count / interval,
+            "errors_per_second": (errors - self.previous_errors) / interval,
+            "requests_in_progress": sum(list(self.registry.in_progress.values())),
+            "tf_cache_memory_bytes": tf_cache.stats()["memory_bytes"],
+            "compute_available_slots": compute.stats()["available_slots"],
+        }
+        if delta_count:
+            values["latency_avg"] = (total - self.previous_total) / delta_count
+            values["latency_p50"] = latency.percentile(0.50, delta_counts, delta_count)
+            values["latency_p95"] = latency.percentile(0.95, delta_counts, delta_count)
+            values["latency_p99"] = latency.percentile(0.99, delta_counts, delta_count)
+
+        self.previous_counts, self.previous_total, self.previous_errors = counts, total, errors
+        return values
+
+
+def write_samples(samples):
+    # Вся пачка одной транзакцией
+    conn = get_db_connection()
+    conn.executemany(
+        "INSERT OR REPLACE INTO main_metrics_sample (name, resolution, timestamp, value) VALUES (?, ?, ?, ?)",
+        [
+            (name, METRICS_SAMPLE_INTERVAL_SECONDS, timestamp, value)
+            for timestamp, values in samples
+            for name, value in values.items()
+        ]
+    )
+    conn.commit()
+    conn.close()
+
+
+def apply_retention(now=None):
+    now = int(time.time() if now is None else now)
+    # Сжимаем только полные часы, чтобы час не усреднялся дважды по частям
+    cutoff = (now - METRICS_RAW_RETENTION_HOURS * 3600) // DOWNSAMPLED_RESOLUTION * DOWNSAMPLED_RESOLUTION
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("""
+        INSERT OR REPLACE INTO main_metrics_sample (name, resolution, timestamp, value)
+        SELECT name, ?, timestamp / ? * ?, AVG(value)
+        FROM main_metrics_sample
+        WHERE resolution < ? AND timestamp < ?
+        GROUP BY name, timestamp / ?
+    """, (
+        DOWNSAMPLED_RESOLUTION, DOWNSAMPLED_RESOLUTION, DOWNSAMPLED_RESOLUTION,
+        DOWNSAMPLED_RESOLUTION, cutoff, DOWNSAMPLED_RESOLUTION,
+    ))
+    cursor.execute(
+        "DELETE FROM main_metrics_sample WHERE resolution < ? AND timestamp < ?",
+        (DOWNSAMPLED_RESOLUTION, cutoff)
+    )
+    cursor.execute(
+        "DELETE FROM main_metrics_sample WHERE timestamp < ?",
+        (now - METRICS_RETENTION_DAYS * 86400,)
+    )
+    conn.commit()
+    conn.close()
+
+
+class MetricsFlusher:
+    def __init__(self, registry):
+        self.sampler = Sampler(registry)
+        self.pending = []
+        self.task = None
+        self.last_retention = 0
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(METRICS_SAMPLE_INTERVAL_SECONDS)
+            now = int(time.time())
+            timestamp = now - now % METRICS_SAMPLE_INTERVAL_SECONDS
+            self.pending.append((timestamp, self.sampler.sample(METRICS_SAMPLE_INTERVAL_SECONDS)))
+            if len(self.pending) < METRICS_FLUSH_BATCH:
+                continue
+
+            samples, self.pending = self.pending, []
+            try:
+                await run_in_threadpool(write_samples, samples)
+                if now - self.last_retention >= DOWNSAMPLED_RESOLUTION:
+                    await run_in_threadpool(apply_retention, now)
+                    self.last_retention = now
+            except Exception:
+                # Сбой записи метрик не должен останавливать сбор
+                logger.exception("Не удалось сохранить метрики")
+
+    def start(self):
+        self.task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        if self.pending:
+            samples, self.pending = self.pending, []
+            await run_in_threadpool(write_samples, samples)
+
+
+flusher = MetricsFlusher(metrics.registry)
+
+
+@router.get("/history", summary="История метрики за период")
+def metrics_history(
+    name: str = Query(...),
+    start: Optional[int] = Query(None, description="Начало периода, unix-время в секундах"),
+    end: Optional[int] = Query(None, description="Конец периода, unix-время в секундах"),
+    step: int = Query(60, ge=1, description="Шаг агрегации в секундах"),
+):
+    if name not in SERIES:
+        raise HTTPException(status_code=400, detail=f"Неизвестная метрика, доступны: {', '.join(SERIES)}")
+
+    end = int(time.time()) if end is None else end
+    start = end - 3600 if start is None else start
+    if start > end:
+        raise HTTPException(status_code=400, detail="Начало периода позже конца")
+    if (end - start) // step > MAX_POINTS:
+        raise HTTPException(status_code=400, detail="Слишком много точек, увеличьте шаг")
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT timestamp / ? * ? AS bucket, AVG(value) AS value
+        FROM main_metrics_sample
+        WHERE name = ? AND timestamp BETWEEN ? AND ?
+        GROUP BY bucket
+        ORDER BY bucket
+    """, (step, step, name, start, end))
+    points = [[row["bucket"], round(row["value"], 6)] for row in cursor.fetchall()]
+    conn.close()
+
+    return {"name": name, "start": start, "end": end, "step": step, "points": points}
@@ -0,0 +1,149 @@
+import hashlib
+import os
+
+from starlette.concurrency import run_in_threadpool
+
+try:
+    from python_multipart.exceptions import ParseError
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ModuleNotFoundError:
+    from multipart.exceptions import ParseError
+    from multipart.multipart import MultipartParser, parse_options_header
+
+from fastapi_app.endpoints.blob_storage import UploadTooLarge, new_tmp_path
+
+
+# Тело multipart/form-data разбирается по мере поступления из request.stream(): файлы сразу
+# пишутся во временный каталог (без промежуточной копии, которую делает парсер Starlette),
+# SHA-256 и ограничения размера применяются на лету — слишком большой запрос обрывается сразу.
+
+
+class MultipartError(Exception):
+    pass
+
+
+class RequestTooLarge(Exception):
+    pass
+
+
+class ReceivedFile:
+    def __init__(self, filename):
+        self.filename = filename
+        self.tmp_path = new_tmp_path()
+        self.content_hash = None
+        self.size = 0
+
+
+def _decode(value):
+    try:
+        return value.decode("utf-8")
+    except UnicodeDecodeError:
+        return value.decode("latin-1")
+
+
+def multipart_openapi(field, many=False):
+    # Тело читается вручную, поэтому схему формы для документации описываем явно
+    schema = {"type": "string", "format": "binary"}
+    if many:
+        schema = {"type": "array", "items": schema}
+    return {
+        "requestBody": {
+            "required": True,
+            "content": {
+                "multipart/form-data": {
+                    "schema": {"type": "object", "required": [field], "properties": {field: schema}}
+                }
+            },
+        }
+    }
+
+
+async def iter_uploaded_files(request, field, max_size, max_total=None):
+    # Отдаёт ReceivedFile по каждому файлу поля field после того, как он полностью записан.
+    # Файл больше max_size — UploadTooLarge, тело больше max_total — RequestTooLarge.
+    # Временные файлы отданных записей удаляет вызывающий
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    boundary = params.get(b"boundary")
+    if content_type != b"multipart/form-data" or not boundary:
+        raise MultipartError()
+
+    events = []
+    header = {"field": b"", "value": b"", "disposition": b""}
+
+    def on_header_field(data, start, end):
+        header["field"] += data[start:end]
+
+    def on_header_value(data, start, end):
+        header["value"] += data[start:end]
+
+    def on_header_end():
+        if header["field"].lower() == b"content-disposition":
+            header["disposition"] = header["value"]
+        header["field"] = header["value"] = b""
+
+    def on_headers_finished():
+        _, options = parse_options_header(header["disposition"])
+        header["disposition"] = b""
+        filename = options.get(b"filename")
+        events.append(("part", (_decode(options.get(b"name", b"")), None if filename is None else _decode(filename))))
+
+    parser = MultipartParser(boundary, {
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": lambda data, start, end: events.append(("data", data[start:end])),
+        "on_part_end": lambda: events.append(("end", None)),
+    })
+
+    current = None
+    buffer = None
+    digest = None
+    pending = []
+    total = 0
+    try:
+        async for chunk in request.stream():
+            try:
+                if chunk:
+                    parser.write(chunk)
+                else:
+                    parser.finalize()
+            except ParseError as exc:
+                raise MultipartError() from exc
+
+            batch = list(events)
+            events.clear()
+            for kind, value in batch:
+                if kind == "part":
+                    name, filename = value
+                    if name == field and filename is not None:
+                        current = ReceivedFile(filename)
+                        buffer = open(current.tmp_path, "wb")
+                        digest = hashlib.sha256()
+                elif kind == "data":
+                    total += len(value)
+                    if max_total is not None and total > max_total:
+                        raise RequestTooLarge()
+                    if current is None:
+                        continue
+                    current.size += len(value)
+                    if current.size > max_size:
+                        raise UploadTooLarge()
+                    digest.update(value)
+                    pending.append(value)
+                elif kind == "end" and current is not None:
+                    await run_in_threadpool(buffer.write, b"".join(pending))
+                    buffer.close()
+                    current.content_hash = digest.hexdigest()
+                    pending.clear()
+                    received, current = current, None
+                    yield received
+            if pending:
+                await run_in_threadpool(buffer.write, b"".join(pending))
+                pending.clear()
+    finally:
+        # Недописанный файл (обрыв, ошибка, превышение лимита) не оставляем на диске
+        if current is not None:
+            buffer.close()
+            if os.path.exists(current.tmp_path):
+                os.remove(current.tmp_path)
@@ -1,34 +1,61 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Response
 from .auth import get_current_user
-from .database import init_db 
-import sqlite3
-from sklearn.feature_extraction.text import TfidfVectorizer
-import os
+from .database import get_db_connection
+from . import analytics, compute
+from .inverted_index import user_corpus_version
+from .jobs import make_fingerprint, start_job
+from .pagination import page_params, paginate, stream_param, stream_rows
+from itertools import groupby
+from typing import Optional
 
 router = APIRouter()
-DB_PATH = os.getenv("DB_PATH")
-
-def get_db_connection():
-    init_db()
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
 
 @router.get("/", summary="Список коллекций")
-def list_collections(user_id: int = Depends(get_current_user)):
+def list_collections(
+    response: Response,
+    include_documents: bool = True,
+    page: tuple = Depends(page_params),
+    user_id: int = Depends(get_current_user),
+):
+    after_id, limit = page
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute("SELECT id, name FROM main_collection WHERE user_id = ?", (user_id,))
+    if not include_documents:
+        cursor.execute(
+            "SELECT id, name FROM main_collection WHERE user_id = ? AND id > ? ORDER BY id LIMIT ?",
+            (user_id, after_id, limit + 1)
+        )
+        collections = [{"id": row["id"], "name": row["name"]} for row in cursor.fetchall()]
+        conn.close()
+        return paginate(response, collections, limit)
+
+    # Один запрос на страницу: коллекции и их документы одним JOIN, группировка в Python
+    cursor.execute("""
+        SELECT c.id, c.name, cd.document_id
+        FROM (
+            SELECT id, name FROM main_collection
+            WHERE user_id = ? AND id > ?
+            ORDER BY id LIMIT ?
+        ) c
+        LEFT JOIN main_collection_documents cd ON cd.collection_id = c.id
+        ORDER BY c.id, cd.document_id
+    """, (user_id, after_id, limit + 1))
     collections = []
-    for col in cursor.fetchall():
-        cursor.execute("SELECT document_id FROM main_collection_documents WHERE collection_id = ?", (col["id"],))
-        docs = [row["document_id"] for row in cursor.fetchall()]
-        collections.append({"id": col["id"], "name": col["name"], "documents": docs})
+    for (collection_id, name), rows in groupby(cursor, key=lambda row: (row["id"], row["name"])):
+        docs = [row["document_id"] for row in rows if row["document_id"] is not None]
+        collections.append({"id": collection_id, "name": name, "documents": docs})
     conn.close()
-    return collections
+    return paginate(response, collections, limit)
 
 @router.get("/{collection_id}", summary="Документы в коллекции")
-def collection_documents(collection_id: int, user_id: int = Depends(get_current_user)):
+def collection_documents(
+    collection_id: int,
+    response: Response,
+    page: tuple = Depends(page_params),
+    stream: Optional[str] = Depends(stream_param),
+    user_id: int = Depends(get_current_user),
+):
+    after_id, limit = page
     conn = get_db_connection()
     cursor = conn.cursor()
     cursor.execute("SELECT user_id FROM main_collection WHERE id = ?", (collection_id,))
@@ -36,10 +63,20 @@ def collection_documents(collection_id: int, user_id: int = Depends(get_current_
     if not owner or owner["user_id"] != user_id:
         conn.close()
         raise HTTPException(status_code=403, detail="Нет доступа")
-    cursor.execute("SELECT document_id FROM main_collection_documents WHERE collection_id = ?", (collection_id,))
+    if stream:
+        cursor.execute(
+            "SELECT document_id FROM main_collection_documents WHERE collection_id = ? AND document_id > ? ORDER BY document_id",
+            (collection_id, after_id)
+        )
+        return stream_rows(conn, cursor, stream, lambda row: row["document_id"], envelope="documents")
+
+    cursor.execute(
+        "SELECT document_id FROM main_collection_documents WHERE collection_id = ? AND document_id > ? ORDER BY document_id LIMIT ?",
+        (collection_id, after_id, limit + 1)
+    )
     doc_ids = [row["document_id"] for row in cursor.fetchall()]
     conn.close()
-    return {"documents": doc_ids}
+    return {"documents": paginate(response, doc_ids, limit, key=None)}
 
 @router.post("/{collection_id}/{document_id}", summary="Добавить документ в коллекцию")
 def add_document_to_collection(collection_id: int, document_id: int, user_id: int = Depends(get_current_user)):
@@ -50,11 +87,14 @@ def add_document_to_collection(collection_id: int, document_id: int, user_id: in
     if not owner or owner["user_id"] != user_id:
         conn.close()
         raise HTTPException(status_code=403, detail="Нет доступа")
-    cursor.execute("SELECT 1 FROM main_collection_documents WHERE collection_id = ? AND document_id = ?", (collection_id, document_id))
-    if cursor.fetchone():
+    # Дубликаты отсекает UNIQUE-индекс (collection_id, document_id), без гонки SELECT-then-INSERT
+    cursor.execute("""
+        INSERT INTO main_collection_documents (collection_id, document_id) VALUES (?, ?)
+        ON CONFLICT(collection_id, document_id) DO NOTHING
+    """, (collection_id, document_id))
+    if cursor.rowcount == 0:
         conn.close()
         raise HTTPException(status_code=400, detail="Документ уже добавлен")
-    cursor.execute("INSERT INTO main_collection_documents (collection_id, document_id) VALUES (?, ?)", (collection_id, document_id))
     conn.commit()
     conn.close()
     return {"message": "Документ добавлен"}
@@ -76,75 +116,24 @@ def remove_document_from_collection(collection_id: int, document_id: int, user_i
 
 
 @router.get("/{collection_id}/statistics", summary="TF-IDF по коллекции")
-def collection_statistics(collection_id: int, user_id: int = Depends(get_current_user)):
-    conn = get_db_connection()
-    cursor = conn.cursor()
+async def collection_statistics(collection_id: int, user_id: int = Depends(get_current_user)):
+    return await compute.run(analytics.collection_statistics, collection_id, user_id)
 
-    # Получаем все документы пользователя (для IDF)
-    cursor.execute("SELECT path FROM main_document WHERE user_id = ?", (user_id,))
-    all_user_doc_rows = cursor.fetchall()
 
-    all_user_docs = []
-    for row in all_user_doc_rows:
-        if os.path.exists(row["path"]):
-            with open(row["path"], "r", encoding="utf-8") as f:
-                text = f.read().strip()
-                if text:
-                    all_user_docs.append(text)
-
-    if not all_user_docs:
+@router.post("/{collection_id}/statistics/jobs", status_code=202, summary="Фоновый расчёт TF-IDF по коллекции")
+def collection_statistics_job(collection_id: int, user_id: int = Depends(get_current_user)):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT user_id FROM main_collection WHERE id = ?", (collection_id,))
+    owner = cursor.fetchone()
+    if not owner or owner["user_id"] != user_id:
         conn.close()
-        raise HTTPException(status_code=400, detail="У пользователя нет документов для расчёта IDF")
-
-    # Получаем документы из коллекции (для TF)
-    cursor.execute("""
-        SELECT d.path
-        FROM main_document d
-        JOIN main_collection_documents cd ON cd.document_id = d.id
-        WHERE cd.collection_id = ? AND d.user_id = ?
-    """, (collection_id, user_id))
-    collection_doc_rows = cursor.fetchall()
+        raise HTTPException(status_code=403, detail="Нет доступа")
+    cursor.execute(
+        "SELECT document_id FROM main_collection_documents WHERE collection_id = ? ORDER BY document_id",
+        (collection_id,)
+    )
+    member_ids = ",".join(str(row["document_id"]) for row in cursor.fetchall())
+    fingerprint = make_fingerprint("collection", collection_id, member_ids, user_corpus_version(cursor, user_id))
     conn.close()
-
-    collection_docs = []
-    for row in collection_doc_rows:
-        if os.path.exists(row["path"]):
-            with open(row["path"], "r", encoding="utf-8") as f:
-                text = f.read().strip()
-                if text:
-                    collection_docs.append(text)
-
-    if not collection_docs:
-        raise HTTPException(status_code=400, detail="Коллекция пуста или документы недоступны")
-
-    # TF: как будто все документы в коллекции — один документ
-    merged_collection_text = " ".join(collection_docs)
-
-    # Обучаем IDF на всех документах пользователя
-    vectorizer = TfidfVectorizer(use_idf=True)
-    vectorizer.fit(all_user_docs)
-
-    # Преобразуем объединённую коллекцию (TF * IDF)
-    tfidf_vector = vectorizer.transform([merged_collection_text])
-    feature_names = vectorizer.get_feature_names_out()
-    scores = tfidf_vector.toarray()[0]
-
-    # Получаем IDF отдельно
-    idf_scores = dict(zip(feature_names, vectorizer.idf_))
-    tfidf_data = []
-
-    for idx, word in enumerate(feature_names):
-        tf_value = scores[idx] / idf_scores[word]  # tf = tfidf / idf
-        tfidf_data.append({
-            "word": word,
-            "tf": round(tf_value, 6),
-            "idf": round(idf_scores[word], 6)
-        })
-
-    # Сортируем по tf (редкие слова в коллекции) и берём 50
-    tfidf_data.sort(key=lambda x: x["tf"])
-
-    return {
-        "collection_id": collection_id,
-        "rare_words": tfidf_data[:50]
-    }
\ No newline at end of file
+    return start_job(user_id, "collection", collection_id, fingerprint, analytics.collection_statistics, collection_id, user_id)
@@ -0,0 +1,82 @@
+from fastapi import Query, Response
+from fastapi.responses import StreamingResponse
+from typing import Optional
+import json
+import os
+
+
+DEFAULT_PAGE_SIZE = int(os.getenv("DEFAULT_PAGE_SIZE", "100"))
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "1000"))
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+STREAM_FETCH_SIZE = 500
+
+
+def page_params(
+    cursor: int = Query(0, ge=0, description="id последней записи предыдущей страницы (из заголовка X-Next-Cursor)"),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="Размер страницы"),
+):
+    return cursor, limit
+
+
+def offset_page_params(
+    offset: int = Query(0, ge=0, description="Смещение (из заголовка X-Next-Cursor предыдущей страницы)"),
+    limit: int = Query(20, ge=1, le=MAX_PAGE_SIZE, description="Размер страницы"),
+):
+    return offset, limit
+
+
+def stream_param(
+    stream: Optional[str] = Query(
+        None,
+        pattern="^(json|ndjson)$",
+        description="Потоковая выдача всех записей после cursor без limit: json (массив) или ndjson",
+    ),
+):
+    return stream
+
+
+def paginate(response: Response, items, limit, key="id"):
+    # Запрос выбирает limit + 1 строк: лишняя строка означает, что есть следующая страница
+    if len(items) > limit:
+        items = items[:limit]
+        last = items[-1]
+        response.headers[NEXT_CURSOR_HEADER] = str(last if key is None else last[key])
+    return items
+
+
+def paginate_offset(response: Response, items, offset, limit):
+    # Для выдачи, упорядоченной не по id (например, по релевантности)
+    if len(items) > limit:
+        items = items[:limit]
+        response.headers[NEXT_CURSOR_HEADER] = str(offset + limit)
+    return items
+
+
+def stream_rows(conn, cursor, fmt, to_item, envelope=None):
+    # Строки читаются из курсора порциями и сразу отдаются клиенту; соединение
+    # возвращается в пул, когда генератор завершён или клиент отключился
+    def generate():
+        try:
+            if fmt == "json":
+                yield f'{{"{envelope}": [' if envelope else "["
+            first = True
+            while True:
+                rows = cursor.fetchmany(STREAM_FETCH_SIZE)
+                if not rows:
+                    break
+                chunk = []
+                for row in rows:
+                    item = json.dumps(to_item(row), ensure_ascii=False)
+                    if fmt == "ndjson":
+                        chunk.append(item + "\n")
+                    else:
+                        chunk.append(item if first else "," + item)
+                        first = False
+                yield "".join(chunk)
+            if fmt == "json":
+                yield "]}" if envelope else "]"
+        finally:
+            conn.close()
+
+    media_type = "application/x-ndjson" if fmt == "ndjson" else "application/json"
+    return StreamingResponse(generate(), media_type=media_type)
@@ -0,0 +1,62 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from passlib.context import CryptContext
+
+
+PASSWORD_BCRYPT_ROUNDS = int(os.getenv("PASSWORD_BCRYPT_ROUNDS", "12"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS") or os.cpu_count() or 2)
+
+
+def make_context(rounds=PASSWORD_BCRYPT_ROUNDS):
+    # hex_sha256 — старые несолёные хэши: проверяются, но при успешном входе заменяются на bcrypt.
+    # min_rounds = rounds, чтобы после повышения стоимости хэши тоже пересчитывались
+    return CryptContext(
+        schemes=["bcrypt", "hex_sha256"],
+        deprecated=["hex_sha256"],
+        bcrypt__rounds=rounds,
+        bcrypt__min_rounds=rounds,
+    )
+
+
+pwd_context = make_context()
+
+# Отдельный пул: bcrypt отпускает GIL, и долгий хэш не занимает ни event loop, ни общий пул потоков
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+        return _executor
+
+
+def shutdown():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
+
+
+async def run(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(get_executor(), fn, *args)
+
+
+async def hash_password(password: str) -> str:
+    return await run(pwd_context.hash, password)
+
+
+async def verify_password(password: str, hashed: Optional[str]):
+    # Возвращает (совпал ли пароль, новый хэш или None); для несуществующего пользователя
+    # выполняется холостая проверка, чтобы время ответа не выдавало наличие логина
+    if hashed is None:
+        await run(pwd_context.dummy_verify)
+        return False, None
+    return await run(pwd_context.verify_and_update, password, hashed)
@@ -0,0 +1,212 @@
+import math
+import os
+import threading
+
+import numpy as np
+from scipy import sparse
+
+from fastapi_app.endpoints.inverted_index import user_corpus_version, user_document_count
+from fastapi_app.endpoints.lru import LRUCache
+
+
+# Матрица пользователя: по строке на документ, L2-нормированный TF-IDF (сглаженный IDF,
+# как в collection_statistics). Поиск похожих — одно умножение разреженной матрицы на вектор.
+# Новые документы дописываются в отдельный блок, удалённые помечаются в маске;
+# когда изменений накапливается больше SIMILARITY_REBUILD_FRACTION, матрица строится заново
+# (IDF старых строк к этому моменту успевает устареть).
+# Матрицы живут в процессах пула вычислений (compute.py), кэш ограничен их суммарным размером.
+
+SIMILARITY_CACHE_MEMORY_MB = float(os.getenv("SIMILARITY_CACHE_MEMORY_MB", "256"))
+SIMILARITY_REBUILD_FRACTION = float(os.getenv("SIMILARITY_REBUILD_FRACTION", "0.1"))
+FETCH_SIZE = 10000
+
+
+def idf(total_docs, doc_count):
+    return math.log((1 + total_docs) / (1 + doc_count)) + 1
+
+
+def normalize_rows(matrix):
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1.0
+    return sparse.csr_matrix(sparse.diags(1.0 / norms) @ matrix)
+
+
+class UserMatrix:
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.lock = threading.Lock()
+        self.version = None
+        self.vocabulary = {}
+        self.base = None
+        self.base_ids = np.zeros(0, dtype=np.int64)
+        self.delta = None
+        self.delta_ids = np.zeros(0, dtype=np.int64)
+        self.alive_base = np.zeros(0, dtype=bool)
+        self.alive_delta = np.zeros(0, dtype=bool)
+        self.changes = 0
+
+    def load_rows(self, cursor, document_ids=None):
+        # Частоты терминов из инвертированного индекса -> строки TF-IDF в текущем словаре
+        total_docs = user_document_count(cursor, self.user_id)
+        cursor.execute("SELECT term, doc_count FROM main_term_df WHERE user_id = ?", (self.user_id,))
+        vocabulary = self.vocabulary
+        df_rows = cursor.fetchall()
+        for term, _ in df_rows:
+            if term not in vocabulary:
+                vocabulary[term] = len(vocabulary)
+        weights = np.zeros(len(vocabulary))
+        for term, doc_count in df_rows:
+            weights[vocabulary[term]] = idf(total_docs, doc_count)
+
+        only_documents = ""
+        params = (self.user_id,)
+        if document_ids is not None:
+            only_documents = "AND i.document_id IN (SELECT value FROM json_each(?))"
+            params += ("[" + ",".join(str(int(i)) for i in document_ids) + "]",)
+        cursor.execute(f"""
+            SELECT t.document_id, t.term, t.count
+            FROM main_document_index i
+            JOIN main_document_terms t ON t.document_id = i.document_id
+            WHERE i.user_id = ? {only_documents}
+            ORDER BY t.document_id
+        """, params)
+
+        # Порции строк разбираются векторно: словарь — единственная операция на уровне Python
+        document_parts, column_parts, count_parts = [], [], []
+        while True:
+            chunk = cursor.fetchmany(FETCH_SIZE)
+            if not chunk:
+                break
+            chunk_ids, terms, counts = zip(*chunk)
+            document_parts.append(np.array(chunk_ids, dtype=np.int64))
+            column_parts.append(np.fromiter(map(vocabulary.__getitem__, terms), dtype=np.int64, count=len(terms)))
+            count_parts.append(np.array(counts, dtype=np.float64))
+
+        if not document_parts:
+            return np.zeros(0, dtype=np.int64), sparse.csr_matrix((0, len(vocabulary)))
+        document_ids = np.concatenate(document_parts)
+        columns = np.concatenate(column_parts)
+        ids, rows = np.unique(document_ids, return_inverse=True)
+        matrix = sparse.csr_matrix(
+            (np.concatenate(count_parts) * weights[columns], (rows, columns)),
+            shape=(len(ids), len(vocabulary)),
+        )
+        return ids, normalize_rows(matrix)
+
+    def rebuild(self, cursor, version):
+        self.vocabulary = {}
+        self.base_ids, self.base = self.load_rows(cursor)
+        self.alive_base = np.ones(len(self.base_ids), dtype=bool)
+        self.delta, self.delta_ids = None, np.zeros(0, dtype=np.int64)
+        self.alive_delta = np.zeros(0, dtype=bool)
+        self.changes = 0
+        self.version = version
+
+    def refresh(self, cursor):
+        # Версия корпуса меняется при каждой загрузке/удалении, в том числе в других процессах
+        version = user_corpus_version(cursor, self.user_id)
+        if version == self.version:
+            return
+        if self.base is None:
+            self.rebuild(cursor, version)
+            return
+
+        cursor.execute("SELECT document_id FROM main_document_index WHERE user_id = ?", (self.user_id,))
+        current = np.fromiter((row[0] for row in cursor.fetchall()), dtype=np.int64)
+        known = np.concatenate([self.base_ids[self.alive_base], self.delta_ids[self.alive_delta]])
+        added = np.setdiff1d(current, known, assume_unique=True)
+        removed = np.setdiff1d(known, current, assume_unique=True)
+
+        self.changes += len(added) + len(removed)
+        if self.changes > SIMILARITY_REBUILD_FRACTION * max(len(current), 1):
+            self.rebuild(cursor, version)
+            return
+
+        if len(removed):
+            self.alive_base &= ~np.isin(self.base_ids, removed)
+            self.alive_delta &= ~np.isin(self.delta_ids, removed)
+        if len(added):
+            ids, rows = self.load_rows(cursor, added)
+            if self.delta is None:
+                self.delta, self.delta_ids, self.alive_delta = rows, ids, np.ones(len(ids), dtype=bool)
+            else:
+                width = len(self.vocabulary)
+                self.delta = sparse.vstack([resize(self.delta, width), rows], format="csr")
+                self.delta_ids = np.concatenate([self.delta_ids, ids])
+                self.alive_delta = np.concatenate([self.alive_delta, np.ones(len(ids), dtype=bool)])
+        self.version = version
+
+    @property
+    def nbytes(self):
+        size = self.base_ids.nbytes + self.delta_ids.nbytes + self.alive_base.nbytes + self.alive_delta.nbytes
+        for matrix in (self.base, self.delta):
+            if matrix is not None:
+                size += matrix.data.nbytes + matrix.indices.nbytes + matrix.indptr.nbytes
+        return size
+
+    def row(self, document_id):
+        for ids, alive, matrix in ((self.base_ids, self.alive_base, self.base), (self.delta_ids, self.alive_delta, self.delta)):
+            positions = np.nonzero((ids == document_id) & alive)[0]
+            if len(positions):
+                return matrix.getrow(positions[0])
+        return None
+
+    def similar(self, document_id, k):
+        query = self.row(document_id)
+        if query is None:
+            return None
+        # Плотный вектор запроса: умножение CSR на плотный вектор быстрее разреженного произведения
+        vector = np.zeros(len(self.vocabulary))
+        vector[query.indices] = query.data
+
+        ids, scores = [], []
+        for matrix, matrix_ids, alive in ((self.base, self.base_ids, self.alive_base), (self.delta, self.delta_ids, self.alive_delta)):
+            if matrix is None or not len(matrix_ids):
+                continue
+            part = matrix @ vector[:matrix.shape[1]]
+            part[~alive] = -np.inf
+            part[matrix_ids == document_id] = -np.inf
+            ids.append(matrix_ids)
+            scores.append(part)
+        if not ids:
+            return []
+
+        ids, scores = np.concatenate(ids), np.concatenate(scores)
+        k = min(k, int(np.isfinite(scores).sum()))
+        if k <= 0:
+            return []
+        # Частичная выборка k лучших, сортируем только их
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(int(ids[i]), float(scores[i])) for i in top]
+
+
+def resize(matrix, width):
+    if matrix.shape[1] == width:
+        return matrix
+    matrix = matrix.tocsr(copy=True)
+    matrix.resize((matrix.shape[0], width))
+    return matrix
+
+
+_matrices = LRUCache(max_bytes=int(SIMILARITY_CACHE_MEMORY_MB * 1024 * 1024))
+_matrices_lock = threading.Lock()
+
+
+def user_matrix(user_id):
+    with _matrices_lock:
+        matrix = _matrices.get(user_id)
+        if matrix is None:
+            matrix = UserMatrix(user_id)
+            _matrices.put(user_id, matrix)
+        return matrix
+
+
+def similar_documents(cursor, user_id, document_id, k):
+    matrix = user_matrix(user_id)
+    # Одна сборка/обновление матрицы на пользователя, параллельные запросы ждут её
+    with matrix.lock:
+        matrix.refresh(cursor)
+        # Размер известен только после сборки: обновляем его в кэше (матрица больше бюджета не кэшируется)
+        _matrices.put(user_id, matrix, matrix.nbytes)
+        return matrix.similar(document_id, k)
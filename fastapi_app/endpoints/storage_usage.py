@@ -0,0 +1,198 @@
+from fastapi_app.endpoints.database import get_db_connection
+from starlette.concurrency import run_in_threadpool
+import asyncio
+import logging
+import os
+import time
+
+
+UPLOAD_DIR = os.getenv("UPLOAD_DIR")
+# 0 — без ограничения
+STORAGE_QUOTA_MB = float(os.getenv("STORAGE_QUOTA_MB", "0"))
+STORAGE_RECONCILE_INTERVAL_SECONDS = int(os.getenv("STORAGE_RECONCILE_INTERVAL_SECONDS", "3600"))
+
+# Строка с user_id = 0 — байты файлов на диске (с учётом дедупликации) и общее число документов,
+# строки пользователей — суммарный размер и число их документов
+GLOBAL_USAGE_ID = 0
+
+logger = logging.getLogger(__name__)
+
+
+class StorageQuotaExceeded(Exception):
+    pass
+
+
+def quota_bytes():
+    return int(STORAGE_QUOTA_MB * 1024 * 1024) if STORAGE_QUOTA_MB > 0 else None
+
+
+def add_usage(cursor, user_id, size, documents=0):
+    cursor.execute("""
+        INSERT INTO main_storage_usage (user_id, bytes, documents) VALUES (?, ?, ?)
+        ON CONFLICT(user_id) DO UPDATE SET
+            bytes = MAX(bytes + excluded.bytes, 0),
+            documents = MAX(documents + excluded.documents, 0)
+    """, (user_id, size, documents))
+
+
+def reserve_usage(cursor, user_id, size):
+    # Проверка квоты и увеличение счётчика одним UPDATE под блокировкой записи —
+    # параллельные загрузки не могут вместе превысить квоту
+    quota = quota_bytes()
+    if quota is None:
+        add_usage(cursor, user_id, size, 1)
+    else:
+        cursor.execute("INSERT OR IGNORE INTO main_storage_usage (user_id) VALUES (?)", (user_id,))
+        cursor.execute("""
+            UPDATE main_storage_usage SET bytes = bytes + ?, documents = documents + 1
+            WHERE user_id = ? AND bytes + ? <= ?
+        """, (size, user_id, size, quota))
+        if cursor.rowcount == 0:
+            raise StorageQuotaExceeded()
+    add_usage(cursor, GLOBAL_USAGE_ID, 0, 1)
+
+
+def release_usage(cursor, user_id, size, documents=1):
+    add_usage(cursor, user_id, -size, -documents)
+    add_usage(cursor, GLOBAL_USAGE_ID, 0, -documents)
+
+
+def get_usage(cursor, user_id):
+    cursor.execute("SELECT bytes, documents FROM main_storage_usage WHERE user_id = ?", (user_id,))
+    row = cursor.fetchone()
+    return (row["bytes"], row["documents"]) if row else (0, 0)
+
+
+def remaining_quota(user_id):
+    quota = quota_bytes()
+    if quota is None:
+        return None
+    conn = get_db_connection()
+    used, _ = get_usage(conn.cursor(), user_id)
+    conn.close()
+    return max(quota - used, 0)
+
+
+def directory_size(path):
+    # Служебные каталоги (.tmp, .tf_cache) не считаем — это не хранимые документы
+    total = 0
+    stack = [path]
+    while stack:
+        try:
+            entries = os.scandir(stack.pop())
+        except FileNotFoundError:
+            continue
+        with entries:
+            for entry in entries:
+                if entry.name.startswith("."):
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    total += entry.stat(follow_symlinks=False).st_size
+    return total
+
+
+def backfill_document_sizes(cursor):
+    # Документы, загруженные до появления колонки size
+    cursor.execute("""
+        UPDATE main_document
+        SET size = (SELECT size FROM main_blob WHERE main_blob.path = main_document.path)
+        WHERE size IS NULL
+    """)
+    cursor.execute("SELECT id, path FROM main_document WHERE size IS NULL")
+    sizes = []
+    for row in cursor.fetchall():
+        try:
+            sizes.append((os.path.getsize(row["path"]), row["id"]))
+        except OSError:
+            sizes.append((0, row["id"]))
+    cursor.executemany("UPDATE main_document SET size = ? WHERE id = ?", sizes)
+
+
+def reconcile(conn):
+    # Исправляем накопившееся расхождение счётчиков с фактическими данными
+    cursor = conn.cursor()
+    cursor.execute("BEGIN IMMEDIATE")
+    backfill_document_sizes(cursor)
+    cursor.execute("""
+        INSERT INTO main_storage_usage (user_id, bytes, documents)
+        SELECT user_id, SUM(size), COUNT(*) FROM main_document GROUP BY user_id
+        ON CONFLICT(user_id) DO UPDATE SET bytes = excluded.bytes, documents = excluded.documents
+    """)
+    cursor.execute("""
+        DELETE FROM main_storage_usage
+        WHERE user_id != ? AND user_id NOT IN (SELECT DISTINCT user_id FROM main_document)
+    """, (GLOBAL_USAGE_ID,))
+
+    # Обход диска — под той же блокировкой записи: файлы блобов появляются и удаляются только
+    # внутри транзакций, поэтому результат обхода согласован с данными и счётчик можно
+    # просто перезаписать. Загрузки на это время ждут блокировку; обход читает только
+    # метаданные файлов и выполняется одним процессом раз в STORAGE_RECONCILE_INTERVAL_SECONDS
+    actual = directory_size(UPLOAD_DIR)
+    cursor.execute("SELECT COUNT(*) FROM main_document")
+    documents = cursor.fetchone()[0]
+    cursor.execute("""
+        INSERT INTO main_storage_usage (user_id, bytes, documents) VALUES (?, ?, ?)
+        ON CONFLICT(user_id) DO UPDATE SET bytes = excluded.bytes, documents = excluded.documents
+    """, (GLOBAL_USAGE_ID, actual, documents))
+    conn.commit()
+    return actual
+
+
+def claim_periodic_run(name, interval):
+    # Периодическую работу выполняет один процесс из всех воркеров: кто первым сдвинул
+    # next_run_at, тот и запускает этот проход
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    now = time.time()
+    try:
+        cursor.execute("INSERT OR IGNORE INTO main_periodic_run (name, next_run_at) VALUES (?, 0)", (name,))
+        cursor.execute(
+            "UPDATE main_periodic_run SET next_run_at = ? WHERE name = ? AND next_run_at <= ?",
+            (now + interval, name, now)
+        )
+        claimed = cursor.rowcount == 1
+        conn.commit()
+    finally:
+        conn.close()
+    return claimed
+
+
+def reconcile_storage():
+    conn = get_db_connection()
+    try:
+        return reconcile(conn)
+    finally:
+        conn.close()
+
+
+class StorageReconciler:
+    def __init__(self):
+        self.task = None
+
+    async def run(self):
+        # Первый проход сразу — заполняет счётчики для уже существующих файлов.
+        # Воркеры проверяют очередь чаще интервала, проход выполняет только один из них
+        while True:
+            try:
+                if await run_in_threadpool(claim_periodic_run, "storage_reconcile", STORAGE_RECONCILE_INTERVAL_SECONDS):
+                    await run_in_threadpool(reconcile_storage)
+            except Exception:
+                logger.exception("Не удалось пересчитать занятое место")
+            await asyncio.sleep(min(STORAGE_RECONCILE_INTERVAL_SECONDS, 60))
+
+    def start(self):
+        self.task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+
+reconciler = StorageReconciler()
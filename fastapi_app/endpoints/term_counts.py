@@ -0,0 +1,171 @@
+import heapq
+import os
+import struct
+import sys
+import threading
+
+import numpy as np
+
+
+# Компактное представление частот слов: строки слов хранятся один раз в словаре (Vocabulary),
+# документ — это пара отсортированных массивов (id слова, частота), 8 байт на слово вместо
+# ~100 байт на запись dict[str, int]. Норма и выборка top-k — операции NumPy над массивами.
+# id слов действуют только внутри процесса, на диск пишутся сами слова.
+
+ID_DTYPE = np.uint32
+COUNT_DTYPE = np.uint32
+FILE_MAGIC = b"TCNT"
+FILE_VERSION = 1
+FILE_HEADER = struct.Struct("<4sII")
+# Память на слово сверх самой строки: запись в dict, int id и ячейка списка (замер на CPython 3.11)
+TERM_OVERHEAD_BYTES = 72
+
+
+class TermCountsFormatError(ValueError):
+    pass
+
+
+class Vocabulary:
+    def __init__(self):
+        self.ids = {}
+        self.terms = []
+        self.nbytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.terms)
+
+    def intern(self, terms):
+        ids = self.ids
+        with self._lock:
+            for term in terms:
+                if term not in ids:
+                    ids[term] = len(self.terms)
+                    self.terms.append(term)
+                    self.nbytes += sys.getsizeof(term) + TERM_OVERHEAD_BYTES
+            return np.fromiter(map(ids.__getitem__, terms), dtype=ID_DTYPE, count=len(terms))
+
+    def lookup(self, term):
+        return self.ids.get(term)
+
+    def term_list(self, ids):
+        terms = self.terms
+        return [terms[i] for i in ids.tolist()]
+
+
+class TermCounts:
+    __slots__ = ("vocabulary", "ids", "counts")
+
+    def __init__(self, vocabulary, ids, counts):
+        # ids отсортированы и уникальны, counts выровнены с ними
+        self.vocabulary = vocabulary
+        self.ids = ids
+        self.counts = counts
+
+    @classmethod
+    def from_pairs(cls, vocabulary, terms, counts):
+        ids = vocabulary.intern(terms)
+        order = np.argsort(ids, kind="stable")
+        return cls(vocabulary, ids[order], counts[order])
+
+    @classmethod
+    def from_counter(cls, vocabulary, counter):
+        counts = np.fromiter(counter.values(), dtype=COUNT_DTYPE, count=len(counter))
+        return cls.from_pairs(vocabulary, list(counter), counts)
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def total(self):
+        return int(self.counts.sum(dtype=np.int64))
+
+    @property
+    def nbytes(self):
+        return self.ids.nbytes + self.counts.nbytes
+
+    def terms(self):
+        return self.vocabulary.term_list(self.ids)
+
+    def items(self):
+        return zip(self.terms(), self.counts.tolist())
+
+    def to_dict(self):
+        return dict(self.items())
+
+    def get(self, term, default=0):
+        term_id = self.vocabulary.lookup(term)
+        if term_id is None:
+            return default
+        position = np.searchsorted(self.ids, term_id)
+        if position < len(self.ids) and self.ids[position] == term_id:
+            return int(self.counts[position])
+        return default
+
+    def norm(self):
+        counts = self.counts.astype(np.float64)
+        return float(np.sqrt(np.dot(counts, counts)))
+
+    def top_k(self, k, largest=True):
+        # Как sorted по (частота, слово): при равных частотах — по алфавиту
+        terms = self.terms()
+        counts = self.counts.tolist()
+        return [(terms[i], counts[i]) for i in top_k_indices(self.counts, k, terms, largest)]
+
+    def to_bytes(self):
+        blob = "\n".join(self.terms()).encode("utf-8")
+        return FILE_HEADER.pack(FILE_MAGIC, FILE_VERSION, len(self.ids)) + self.counts.astype("<u4").tobytes() + blob
+
+    @classmethod
+    def from_bytes(cls, vocabulary, data):
+        if len(data) < FILE_HEADER.size:
+            raise TermCountsFormatError("Слишком короткие данные")
+        magic, version, size = FILE_HEADER.unpack_from(data)
+        if magic != FILE_MAGIC or version != FILE_VERSION:
+            raise TermCountsFormatError("Неизвестный формат частот слов")
+        counts_end = FILE_HEADER.size + 4 * size
+        if len(data) < counts_end:
+            raise TermCountsFormatError("Данные обрезаны")
+        counts = np.frombuffer(data, dtype="<u4", count=size, offset=FILE_HEADER.size)
+        try:
+            terms = data[counts_end:].decode("utf-8").split("\n") if size else []
+        except UnicodeDecodeError as exc:
+            raise TermCountsFormatError("Повреждён список слов") from exc
+        if len(terms) != size:
+            raise TermCountsFormatError("Число слов не совпадает с заголовком")
+        return cls.from_pairs(vocabulary, terms, counts.astype(COUNT_DTYPE))
+
+    def save(self, path):
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(self.to_bytes())
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, vocabulary, path):
+        with open(path, "rb") as f:
+            return cls.from_bytes(vocabulary, f.read())
+
+
+def top_k_indices(values, k, labels, largest=True):
+    # np.partition находит k-е значение за линейное время; всё строго лучше него берётся целиком,
+    # среди равных ему — первые по метке. Сортируются только k отобранных элементов
+    values = np.asarray(values)
+    size = len(values)
+    k = min(k, size)
+    if k <= 0:
+        return []
+    if k < size:
+        position = size - k if largest else k - 1
+        threshold = np.partition(values, position)[position]
+        better = np.flatnonzero(values > threshold if largest else values < threshold).tolist()
+        ties = np.flatnonzero(values == threshold).tolist()
+        chosen = better + heapq.nsmallest(k - len(better), ties, key=labels.__getitem__)
+    else:
+        chosen = list(range(size))
+    chosen_values = values[chosen].tolist()
+    order = sorted(
+        range(len(chosen)),
+        key=lambda i: (-chosen_values[i] if largest else chosen_values[i], labels[chosen[i]])
+    )
+    return [chosen[i] for i in order]
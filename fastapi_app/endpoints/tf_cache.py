@@ -0,0 +1,114 @@
+import hashlib
+import os
+import threading
+
+from fastapi_app.endpoints.lru import LRUCache
+from fastapi_app.endpoints.term_counts import TermCounts, TermCountsFormatError, Vocabulary
+from fastapi_app.endpoints.tokenizer import TOKEN_PATTERN, TOKENIZER_VERSION, count_terms
+
+CACHE_DIR = os.getenv("TF_CACHE_DIR") or os.path.join(os.getenv("UPLOAD_DIR") or "media/files", ".tf_cache")
+CACHE_MEMORY_MB = float(os.getenv("TF_CACHE_MEMORY_MB", "64"))
+CACHE_MEMORY_BYTES = int(CACHE_MEMORY_MB * 1024 * 1024)
+# Словарь входит в тот же бюджет: частоты документов получают остаток, а когда словарь
+# занимает больше этой доли бюджета, он начинается заново вместе с кэшем
+VOCABULARY_BUDGET_FRACTION = 0.5
+HASH_CHUNK_SIZE = 1024 * 1024
+
+_memory = LRUCache(max_bytes=CACHE_MEMORY_BYTES)
+# Общий словарь процесса: документы в кэше хранят только id слов
+_vocabulary = Vocabulary()
+_stats_lock = threading.Lock()
+_disk_hits = 0
+_disk_misses = 0
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cache_key(content_hash, encoding="utf-8", errors="strict"):
+    config = f"{TOKENIZER_VERSION}:{TOKEN_PATTERN}:lower:{encoding}:{errors}"
+    return f"{content_hash}-{hashlib.sha1(config.encode()).hexdigest()[:12]}"
+
+
+def _disk_path(key):
+    return os.path.join(CACHE_DIR, key[:2], f"{key}.tc")
+
+
+def _estimate_size(term_counts):
+    # Строки слов учитываются в словаре один раз, на документ — только массивы id и частот
+    return 64 + term_counts.nbytes
+
+
+def _current_vocabulary():
+    global _vocabulary
+    # Словарь только растёт; при переполнении начинаем новый вместе с кэшем.
+    # Уже выданные TermCounts держат ссылку на свой словарь и остаются корректными
+    if _vocabulary.nbytes > CACHE_MEMORY_BYTES * VOCABULARY_BUDGET_FRACTION:
+        _memory.clear()
+        _vocabulary = Vocabulary()
+    return _vocabulary
+
+
+def _read_disk(key, vocabulary):
+    try:
+        return TermCounts.load(vocabulary, _disk_path(key))
+    except (OSError, TermCountsFormatError):
+        return None
+
+
+def _write_disk(key, term_counts):
+    path = _disk_path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    term_counts.save(path)
+
+
+def get_term_counts(path, content_hash=None, encoding="utf-8", errors="strict"):
+    global _disk_hits, _disk_misses
+
+    if content_hash is None:
+        content_hash = file_hash(path)
+    key = cache_key(content_hash, encoding, errors)
+
+    term_counts = _memory.get(key)
+    if term_counts is not None:
+        return term_counts
+
+    vocabulary = _current_vocabulary()
+    term_counts = _read_disk(key, vocabulary)
+    with _stats_lock:
+        if term_counts is not None:
+            _disk_hits += 1
+        else:
+            _disk_misses += 1
+
+    if term_counts is None:
+        term_counts = TermCounts.from_counter(vocabulary, count_terms(path, encoding, errors))
+        try:
+            _write_disk(key, term_counts)
+        except OSError:
+            pass
+
+    _memory.resize(max(CACHE_MEMORY_BYTES - vocabulary.nbytes, 0))
+    _memory.put(key, term_counts, _estimate_size(term_counts))
+    return term_counts
+
+
+def stats():
+    memory = _memory.stats()
+    with _stats_lock:
+        return {
+            "memory_hits": memory["hits"],
+            "disk_hits": _disk_hits,
+            "misses": _disk_misses,
+            "memory_entries": memory["entries"],
+            "memory_bytes": memory["bytes"],
+            "memory_budget_bytes": CACHE_MEMORY_BYTES,
+            "vocabulary_terms": len(_vocabulary),
+            "vocabulary_bytes": _vocabulary.nbytes,
+            "evictions": memory["evictions"],
+        }
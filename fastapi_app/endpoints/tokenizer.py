@@ -0,0 +1,78 @@
+import os
+import re
+from collections import Counter
+
+
+# Единый токенизатор для TF/IDF: совпадает с token_pattern TfidfVectorizer по умолчанию
+TOKEN_PATTERN = r"\b\w{2,}\b"
+TOKEN_RE = re.compile(TOKEN_PATTERN)
+TOKENIZER_VERSION = 1
+
+# Файл читается кусками фиксированного размера (в символах), память не зависит от размера файла
+TOKENIZER_CHUNK_CHARS = int(os.getenv("TOKENIZER_CHUNK_CHARS", str(1024 * 1024)))
+TRAILING_WORD_RE = re.compile(r"\w*\Z")
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower())
+
+
+def iter_text_chunks(path, encoding="utf-8", errors="strict", chunk_size=None):
+    # TextIOWrapper декодирует инкрементально: многобайтовый символ на границе куска не рвётся
+    chunk_size = chunk_size or TOKENIZER_CHUNK_CHARS
+    with open(path, "r", encoding=encoding, errors=errors) as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+
+def trailing_word_start(text):
+    # Поиск \w*\Z по всей строке пробует каждую позицию, поэтому смотрим только в конец,
+    # расширяя окно, пока хвостовое слово в него не поместится
+    window = 64
+    while True:
+        start = max(len(text) - window, 0)
+        tail = TRAILING_WORD_RE.search(text, start).start()
+        if tail > start or start == 0:
+            return tail
+        window *= 4
+
+
+def iter_word_segments(chunks):
+    # Токен — максимальная серия \w длиной от двух символов, поэтому кусок режем по последнему
+    # не-словесному символу, а хвостовое слово переносим в следующий кусок
+    carry = ""
+    for chunk in chunks:
+        text = carry + chunk
+        tail = trailing_word_start(text)
+        carry = text[tail:]
+        if tail:
+            yield text[:tail]
+    if carry:
+        yield carry
+
+
+def iter_token_chunks(path, encoding="utf-8", errors="strict", chunk_size=None):
+    for segment in iter_word_segments(iter_text_chunks(path, encoding, errors, chunk_size)):
+        yield tokenize(segment)
+
+
+def iter_tokens(path, encoding="utf-8", errors="strict", chunk_size=None):
+    for tokens in iter_token_chunks(path, encoding, errors, chunk_size):
+        yield from tokens
+
+
+def count_terms(path, encoding="utf-8", errors="strict", chunk_size=None):
+    term_counts = Counter()
+    for tokens in iter_token_chunks(path, encoding, errors, chunk_size):
+        term_counts.update(tokens)
+    return term_counts
+
+
+def count_chars(path, encoding="utf-8", errors="strict", chunk_size=None):
+    char_counts = Counter()
+    for chunk in iter_text_chunks(path, encoding, errors, chunk_size):
+        char_counts.update(chunk)
+    return char_counts
@@ -1,24 +1,21 @@
 from fastapi import APIRouter, HTTPException, Depends, status
-from fastapi_app.endpoints.auth import create_access_token, get_current_user
-from fastapi_app.endpoints.database import init_db  
+from fastapi_app.endpoints.auth import create_access_token, forget_token_version, get_current_user, invalid_token
+from fastapi_app.endpoints.database import get_db_connection
+from fastapi_app.endpoints.blob_storage import release_reference
+from fastapi_app.endpoints.documents import drop_huffman_tables
+from fastapi_app.endpoints.inverted_index import unindex_user
+from fastapi_app.endpoints.full_text import unindex_user_text
+from fastapi_app.endpoints.storage_usage import GLOBAL_USAGE_ID, add_usage
+from fastapi_app.endpoints.passwords import hash_password, verify_password
 from pydantic import BaseModel
 from fastapi import Response
+from fastapi_app.endpoints.pagination import page_params, paginate, stream_param, stream_rows
+from starlette.concurrency import run_in_threadpool
+from typing import Optional
 import sqlite3
-import hashlib
-import os
 
 
 router = APIRouter()
-DB_PATH = os.getenv("DB_PATH")
-
-def get_db_connection():
-    init_db()
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
-
-def hash_password(password: str) -> str:
-    return hashlib.sha256(password.encode()).hexdigest()
 
 class UserAuth(BaseModel):
     username: str
@@ -27,54 +24,84 @@ class UserAuth(BaseModel):
 class PasswordUpdate(BaseModel):
     password: str
     
-@router.post("/register", summary="Создание пользователя")
-def register_user(user: UserAuth):
+def insert_user(username: str, password_hash: str):
     conn = get_db_connection()
-    conn.row_factory = sqlite3.Row  # Чтобы fetchone() возвращал словарь
     cursor = conn.cursor()
-
-    cursor.execute("SELECT id FROM main_user WHERE username = ?", (user.username,))
-    if cursor.fetchone():
+    try:
+        cursor.execute("INSERT INTO main_user (username, password) VALUES (?, ?)", (username, password_hash))
+    except sqlite3.IntegrityError:
+        # Имя уже занято (UNIQUE), в том числе параллельной регистрацией
         conn.close()
-        raise HTTPException(status_code=400, detail="Пользователь уже существует")
-
-    cursor.execute("INSERT INTO main_user (username, password) VALUES (?, ?)",
-                   (user.username, hash_password(user.password)))
+        return None
     conn.commit()
-
     user_id = cursor.lastrowid
-
-    cursor.execute("SELECT * FROM main_user WHERE id = ?", (user_id,))
-    new_user = cursor.fetchone()
     conn.close()
 
-    return dict(new_user)  # Преобразуем строку в обычный словарь и возвращаем
+    # Хэш пароля и служебные поля в ответ не попадают
+    return {"id": user_id, "username": username}
 
 
-@router.post("/login", summary="Логин пользователя")
-def login_user(user: UserAuth):
+@router.post("/register", summary="Создание пользователя")
+async def register_user(user: UserAuth):
+    # Хэш считается в отдельном пуле потоков, работа с БД — в общем
+    password_hash = await hash_password(user.password)
+    new_user = await run_in_threadpool(insert_user, user.username, password_hash)
+    if new_user is None:
+        raise HTTPException(status_code=400, detail="Пользователь уже существует")
+    return new_user
+
+
+def find_user(username: str):
     conn = get_db_connection()
     cursor = conn.cursor()
-    hashed_password = hash_password(user.password)
-    cursor.execute("SELECT id FROM main_user WHERE username = ? AND password = ?",
-                   (user.username, hashed_password))
+    cursor.execute("SELECT id, password, token_version FROM main_user WHERE username = ?", (username,))
     row = cursor.fetchone()
     conn.close()
-    if not row:
+    return row
+
+
+def replace_password_hash(user_id: int, old_hash: str, new_hash: str):
+    # Условие на старый хэш — чтобы не затереть пароль, сменённый параллельно
+    conn = get_db_connection()
+    conn.execute("UPDATE main_user SET password = ? WHERE id = ? AND password = ?", (new_hash, user_id, old_hash))
+    conn.commit()
+    conn.close()
+
+
+@router.post("/login", summary="Логин пользователя")
+async def login_user(user: UserAuth):
+    row = await run_in_threadpool(find_user, user.username)
+    verified, new_hash = await verify_password(user.password, row["password"] if row else None)
+    if not verified:
         raise HTTPException(status_code=401, detail="Неверные учётные данные")
-    access_token = create_access_token(data={"sub": str(row["id"])})
+    # Старый SHA-256 или bcrypt с меньшей стоимостью — пересохраняем хэш по текущим настройкам
+    if new_hash:
+        await run_in_threadpool(replace_password_hash, row["id"], row["password"], new_hash)
+    access_token = create_access_token(data={"sub": str(row["id"]), "ver": row["token_version"]})
     return {"access_token": access_token, "token_type": "bearer"}
 
 
-@router.patch("/update", summary="Изменение пароля")
-def update_password(pw: PasswordUpdate, user_id: int = Depends(get_current_user)):
+def store_password(user_id: int, password_hash: str):
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute("UPDATE main_user SET password = ? WHERE id = ?",
-                   (hash_password(pw.password), user_id))
+    # Смена пароля отзывает все выданные ранее токены, взамен выдаём новый
+    cursor.execute("UPDATE main_user SET password = ?, token_version = token_version + 1 WHERE id = ? RETURNING token_version",
+                   (password_hash, user_id))
+    row = cursor.fetchone()
     conn.commit()
     conn.close()
-    return {"message": "Пароль обновлён"}
+    forget_token_version(user_id)
+    # Пользователь мог быть удалён, пока его токен ещё числился в кэше
+    return row["token_version"] if row else None
+
+
+@router.patch("/update", summary="Изменение пароля")
+async def update_password(pw: PasswordUpdate, user_id: int = Depends(get_current_user)):
+    version = await run_in_threadpool(store_password, user_id, await hash_password(pw.password))
+    if version is None:
+        raise invalid_token("Пользователь не найден")
+    access_token = create_access_token(data={"sub": str(user_id), "ver": version})
+    return {"message": "Пароль обновлён", "access_token": access_token, "token_type": "bearer"}
 
 
 @router.delete("/delete", summary="Удаление пользователя")
@@ -82,31 +109,58 @@ def delete_user(user_id: int = Depends(get_current_user)):
     conn = get_db_connection()
     cursor = conn.cursor()
 
+    unindex_user(cursor, user_id)
+    unindex_user_text(cursor, user_id)
+    cursor.execute("SELECT id, path FROM main_document WHERE user_id = ?", (user_id,))
+    documents = cursor.fetchall()
+    paths = [row["path"] for row in documents]
+    drop_huffman_tables(cursor, [row["id"] for row in documents])
+    cursor.execute("DELETE FROM main_storage_usage WHERE user_id = ?", (user_id,))
+    add_usage(cursor, GLOBAL_USAGE_ID, 0, -len(documents))
     cursor.execute("DELETE FROM main_document WHERE user_id = ?", (user_id,))
+    for path in paths:
+        release_reference(cursor, path)
     cursor.execute("DELETE FROM main_collection_documents WHERE collection_id IN (SELECT id FROM main_collection WHERE user_id = ?)", (user_id,))
     cursor.execute("DELETE FROM main_collection WHERE user_id = ?", (user_id,))
     cursor.execute("DELETE FROM main_user WHERE id = ?", (user_id,))
 
     conn.commit()
     conn.close()
+    forget_token_version(user_id)
     return {"message": "Пользователь и все его данные удалены"}
 
 
 @router.get("/all", summary="Получение всех пользователей")
-def get_all_users():
+def get_all_users(
+    response: Response,
+    page: tuple = Depends(page_params),
+    stream: Optional[str] = Depends(stream_param),
+):
+    after_id, limit = page
     conn = get_db_connection()
     cursor = conn.cursor()
 
-    cursor.execute("SELECT id, username FROM main_user")  # Не включаем пароли по соображениям безопасности
+    # Не включаем пароли по соображениям безопасности
+    if stream:
+        cursor.execute("SELECT id, username FROM main_user WHERE id > ? ORDER BY id", (after_id,))
+        return stream_rows(conn, cursor, stream, dict)
+
+    cursor.execute("SELECT id, username FROM main_user WHERE id > ? ORDER BY id LIMIT ?", (after_id, limit + 1))
     users = cursor.fetchall()
     conn.close()
 
-    return [dict(user) for user in users]
+    return paginate(response, [dict(user) for user in users], limit)
 
 
 
 @router.get("/logout")
-def logout_user(response: Response):
+def logout_user(response: Response, user_id: int = Depends(get_current_user)):
+    # Выход отзывает все токены пользователя
+    conn = get_db_connection()
+    conn.execute("UPDATE main_user SET token_version = token_version + 1 WHERE id = ?", (user_id,))
+    conn.commit()
+    conn.close()
+    forget_token_version(user_id)
     response.delete_cookie(key="access_token", httponly=True)
     return {"message": "Выход выполнен. Cookie удалена."}
 
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from dotenv import load_dotenv
+
+
+class Command(BaseCommand):
+    help = "Добавляет в полнотекстовый индекс (FTS5) документы из main_document, которых в нём ещё нет"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument("--rebuild", action="store_true", help="очистить индекс и построить заново")
+
+    def handle(self, *args, **options):
+        load_dotenv()
+        from fastapi_app.endpoints.database import get_db_connection
+        from fastapi_app.endpoints.full_text import backfill
+
+        conn = get_db_connection()
+        try:
+            indexed = backfill(conn, options["batch_size"], options["rebuild"])
+        finally:
+            conn.close()
+        self.stdout.write(self.style.SUCCESS(f"Добавлено в поисковый индекс документов: {indexed}"))
@@ -0,0 +1,41 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from dotenv import load_dotenv
+
+
+class Command(BaseCommand):
+    help = "Замер пропускной способности входа (проверка bcrypt) при разной стоимости хэширования"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rounds", type=int, nargs="+", default=[10, 11, 12, 13])
+        parser.add_argument("--workers", type=int, default=None, help="по умолчанию PASSWORD_HASH_WORKERS")
+        parser.add_argument("--seconds", type=float, default=3.0, help="длительность замера на одну стоимость")
+
+    def handle(self, *args, **options):
+        load_dotenv()
+        from fastapi_app.endpoints.passwords import PASSWORD_BCRYPT_ROUNDS, PASSWORD_HASH_WORKERS, make_context
+
+        workers = options["workers"] or PASSWORD_HASH_WORKERS
+        self.stdout.write(f"потоков: {workers}, текущая стоимость PASSWORD_BCRYPT_ROUNDS={PASSWORD_BCRYPT_ROUNDS}")
+        self.stdout.write(f"{'rounds':<8}{'одна проверка, мс':>20}{'входов в секунду':>20}")
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for rounds in options["rounds"]:
+                context = make_context(rounds)
+                hashed = context.hash("benchmark-password")
+
+                started = time.perf_counter()
+                context.verify("benchmark-password", hashed)
+                single = time.perf_counter() - started
+
+                # Как в login_user: проверки идут параллельно в пуле потоков
+                verified = 0
+                started = time.perf_counter()
+                while time.perf_counter() - started < options["seconds"]:
+                    futures = [executor.submit(context.verify, "benchmark-password", hashed) for _ in range(workers)]
+                    verified += sum(future.result() for future in futures)
+                elapsed = time.perf_counter() - started
+
+                self.stdout.write(f"{rounds:<8}{single * 1000:>20.1f}{verified / elapsed:>20.1f}")
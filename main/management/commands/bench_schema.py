@@ -0,0 +1,129 @@
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+from dotenv import load_dotenv
+
+
+class Command(BaseCommand):
+    help = "Замер времени выборки документов и добавления в коллекцию до и после миграций с индексами"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--documents", type=int, default=1_000_000)
+        parser.add_argument("--users", type=int, default=1_000)
+        parser.add_argument("--collections", type=int, default=10_000)
+        parser.add_argument("--memberships", type=int, default=1_000_000)
+        parser.add_argument("--repeat", type=int, default=200)
+
+    def handle(self, *args, **options):
+        load_dotenv()
+        from fastapi_app.endpoints.database import apply_migrations, create_schema
+
+        # Отдельная временная база, рабочая не затрагивается
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            conn = sqlite3.connect(os.path.join(tmp_dir, "bench.db"))
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+            create_schema(conn)
+            self.seed(conn, options)
+
+            before = self.measure(conn, options, upsert=False)
+            started = time.perf_counter()
+            apply_migrations(conn)
+            migration_seconds = time.perf_counter() - started
+            after = self.measure(conn, options, upsert=True)
+            conn.close()
+
+        self.stdout.write(
+            f"документов: {options['documents']}, пользователей: {options['users']}, "
+            f"коллекций: {options['collections']}, связей: {options['memberships']}"
+        )
+        self.stdout.write(f"миграции применены за {migration_seconds:.2f} с")
+        self.stdout.write(f"{'операция':<34}{'без индексов, мс':>18}{'с индексами, мс':>18}")
+        for name in before:
+            self.stdout.write(f"{name:<34}{before[name]:>18.3f}{after[name]:>18.3f}")
+
+    def seed(self, conn, options):
+        rng = random.Random(42)
+        users = options["users"]
+        conn.executemany(
+            "INSERT INTO main_user (id, username, password) VALUES (?, ?, '')",
+            ((i, f"user{i}") for i in range(1, users + 1))
+        )
+        conn.executemany(
+            "INSERT INTO main_document (name, path, user_id) VALUES (?, ?, ?)",
+            ((f"doc{i}.txt", f"/nonexistent/{i}", rng.randint(1, users)) for i in range(options["documents"]))
+        )
+        conn.executemany(
+            "INSERT INTO main_collection (name, user_id) VALUES (?, ?)",
+            ((f"collection{i}", rng.randint(1, users)) for i in range(options["collections"]))
+        )
+        conn.executemany(
+            "INSERT INTO main_collection_documents (collection_id, document_id) VALUES (?, ?)",
+            (
+                (rng.randint(1, options["collections"]), rng.randint(1, options["documents"]))
+                for _ in range(options["memberships"])
+            )
+        )
+        conn.commit()
+
+    def measure(self, conn, options, upsert):
+        rng = random.Random(7)
+        repeat = options["repeat"]
+        cursor = conn.cursor()
+        results = {}
+
+        def timed(name, operation):
+            started = time.perf_counter()
+            for _ in range(repeat):
+                operation()
+            results[name] = (time.perf_counter() - started) * 1000 / repeat
+
+        def list_documents():
+            cursor.execute("SELECT id, name FROM main_document WHERE user_id = ?", (rng.randint(1, options["users"]),))
+            cursor.fetchall()
+
+        def list_collection():
+            cursor.execute(
+                "SELECT document_id FROM main_collection_documents WHERE collection_id = ?",
+                (rng.randint(1, options["collections"]),)
+            )
+            cursor.fetchall()
+
+        def add_document():
+            collection_id = rng.randint(1, options["collections"])
+            document_id = rng.randint(1, options["documents"])
+            cursor.execute("SELECT user_id FROM main_collection WHERE id = ?", (collection_id,))
+            cursor.fetchone()
+            if upsert:
+                cursor.execute("""
+                    INSERT INTO main_collection_documents (collection_id, document_id) VALUES (?, ?)
+                    ON CONFLICT(collection_id, document_id) DO NOTHING
+                """, (collection_id, document_id))
+            else:
+                cursor.execute(
+                    "SELECT 1 FROM main_collection_documents WHERE collection_id = ? AND document_id = ?",
+                    (collection_id, document_id)
+                )
+                if not cursor.fetchone():
+                    cursor.execute(
+                        "INSERT INTO main_collection_documents (collection_id, document_id) VALUES (?, ?)",
+                        (collection_id, document_id)
+                    )
+            conn.commit()
+
+        def delete_document_links():
+            cursor.execute(
+                "DELETE FROM main_collection_documents WHERE document_id = ?",
+                (rng.randint(1, options["documents"]),)
+            )
+            conn.commit()
+
+        timed("список документов пользователя", list_documents)
+        timed("документы коллекции", list_collection)
+        timed("добавление в коллекцию", add_document)
+        timed("удаление связей документа", delete_document_links)
+        return results
@@ -0,0 +1,67 @@
+import os
+import random
+import re
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+
+from django.core.management.base import BaseCommand
+from dotenv import load_dotenv
+
+
+WORDS = ["документ", "анализ", "частота", "слово", "текст", "document", "frequency", "index", "data", "мир"]
+
+
+class Command(BaseCommand):
+    help = "Сравнение потокового токенизатора с чтением файла целиком: время, МБ/с и пик памяти"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--megabytes", type=int, nargs="+", default=[10, 50])
+        parser.add_argument("--chunk-chars", type=int, default=None, help="по умолчанию TOKENIZER_CHUNK_CHARS")
+
+    def handle(self, *args, **options):
+        load_dotenv()
+        from fastapi_app.endpoints.tokenizer import TOKEN_PATTERN, TOKENIZER_CHUNK_CHARS, count_terms
+
+        chunk_size = options["chunk_chars"] or TOKENIZER_CHUNK_CHARS
+        token_re = re.compile(TOKEN_PATTERN)
+
+        def whole_file(path):
+            with open(path, "r", encoding="utf-8") as f:
+                return Counter(token_re.findall(f.read().lower()))
+
+        def streaming(path):
+            return count_terms(path, "utf-8", chunk_size=chunk_size)
+
+        self.stdout.write(f"размер куска: {chunk_size} символов")
+        self.stdout.write(f"{'МБ':<6}{'способ':<12}{'время, с':>12}{'МБ/с':>10}{'пик памяти, МБ':>18}")
+
+        rng = random.Random(0)
+        for megabytes in options["megabytes"]:
+            handle, path = tempfile.mkstemp(suffix=".txt")
+            try:
+                with os.fdopen(handle, "w", encoding="utf-8") as f:
+                    line = " ".join(rng.choice(WORDS) for _ in range(5000)) + "\n"
+                    while f.tell() < megabytes * 1024 * 1024:
+                        f.write(line)
+                size = os.path.getsize(path) / (1024 * 1024)
+
+                results = []
+                for name, counter in (("целиком", whole_file), ("потоково", streaming)):
+                    started = time.perf_counter()
+                    results.append(counter(path))
+                    elapsed = time.perf_counter() - started
+
+                    # tracemalloc сильно замедляет выполнение, поэтому память меряется отдельным прогоном
+                    tracemalloc.start()
+                    counter(path)
+                    peak = tracemalloc.get_traced_memory()[1]
+                    tracemalloc.stop()
+                    self.stdout.write(
+                        f"{megabytes:<6}{name:<12}{elapsed:>12.2f}{size / elapsed:>10.1f}{peak / (1024 * 1024):>18.1f}"
+                    )
+                if results[0] != results[1]:
+                    self.stderr.write("Результаты токенизаторов различаются")
+            finally:
+                os.remove(path)
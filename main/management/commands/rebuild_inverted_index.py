@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from dotenv import load_dotenv
+
+
+class Command(BaseCommand):
+    help = "Перестраивает инвертированный индекс (TF/DF) по всем документам из main_document"
+
+    def handle(self, *args, **options):
+        load_dotenv()
+        from fastapi_app.endpoints.database import get_db_connection
+        from fastapi_app.endpoints.inverted_index import rebuild_index
+
+        conn = get_db_connection()
+        try:
+            indexed = rebuild_index(conn)
+        finally:
+            conn.close()
+        self.stdout.write(self.style.SUCCESS(f"Проиндексировано документов: {indexed}"))
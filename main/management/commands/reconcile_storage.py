@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from dotenv import load_dotenv
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает счётчики занятого места (по пользователям и по каталогу загрузок)"
+
+    def handle(self, *args, **options):
+        load_dotenv()
+        from fastapi_app.endpoints.storage_usage import reconcile_storage
+
+        total = reconcile_storage()
+        self.stdout.write(self.style.SUCCESS(f"Каталог загрузок занимает {total / (1024 * 1024):.2f} МБ"))
@@ -1,3 +1,329 @@
-from django.test import TestCase
+import hashlib
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+import uuid
+import zipfile
+from collections import Counter
+from unittest import mock
 
-# Create your tests here.
+from django.test import SimpleTestCase
+from fastapi.testclient import TestClient
+
+# Модули fastapi_app читают настройки при импорте, поэтому тестовые БД и каталог файлов
+# задаются до их импорта — рабочие данные тесты не трогают
+TEST_ROOT = tempfile.mkdtemp(prefix="app-tests-")
+os.environ.update({
+    "DB_PATH": os.path.join(TEST_ROOT, "test.db"),
+    "UPLOAD_DIR": os.path.join(TEST_ROOT, "files"),
+    "PASSWORD_BCRYPT_ROUNDS": "4",
+})
+os.environ.setdefault("SECRET_KEY", "test-secret")
+os.environ.setdefault("ALGORITHM", "HS256")
+os.environ.setdefault("ACCESS_TOKEN_EXPIRE_MINUTES", "30")
+
+from combined_asgi import fastapi_app  # noqa: E402
+from fastapi_app.endpoints import (  # noqa: E402
+    database, decoding, huffman, storage_usage, term_counts, tokenizer
+)
+
+
+def tearDownModule():
+    database.pool.close_all()
+    shutil.rmtree(TEST_ROOT, ignore_errors=True)
+
+
+class ApiTestCase(SimpleTestCase):
+    # Запросы к FastAPI-приложению через TestClient на временной БД; пользователи в каждом тесте свои
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        database.pool.ensure_schema()
+        # self.client у SimpleTestCase — клиент Django
+        cls.api = TestClient(fastapi_app)
+
+    def register(self, password="secret-password"):
+        username = f"user-{uuid.uuid4().hex[:12]}"
+        response = self.api.post("/users/register", json={"username": username, "password": password})
+        self.assertEqual(response.status_code, 200, response.text)
+        return username, self.login(username, password)
+
+    def login(self, username, password):
+        response = self.api.post("/users/login", json={"username": username, "password": password})
+        self.assertEqual(response.status_code, 200, response.text)
+        return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    def upload(self, headers, name, data):
+        response = self.api.post("/documents/upload", headers=headers, files={"file": (name, data, "text/plain")})
+        self.assertEqual(response.status_code, 200, response.text)
+        return self.api.get("/documents/", headers=headers).json()[-1]["id"]
+
+    def query(self, sql, params=()):
+        conn = database.get_db_connection()
+        try:
+            return conn.execute(sql, params).fetchone()
+        finally:
+            conn.close()
+
+
+class HuffmanCodecTests(SimpleTestCase):
+    samples = [
+        b"",
+        b"a",
+        b"aaaaaaaa",
+        "Привет, мир! Hello, world!".encode("utf-8"),
+        b"ab" * 1000 + b"c",
+        bytes(range(256)) * 3,
+    ]
+
+    def test_round_trip(self):
+        for data in self.samples + [os.urandom(10000)]:
+            with self.subTest(size=len(data)):
+                self.assertEqual(huffman.decode_bytes(huffman.encode_bytes(data)), data)
+
+    def test_streaming_matches_in_memory(self):
+        for data in self.samples:
+            with self.subTest(size=len(data)):
+                streamed = b"".join(huffman.encode_stream(lambda: io.BytesIO(data), chunk_size=7))
+                self.assertEqual(streamed, huffman.encode_bytes(data))
+
+    def test_decode_split_across_chunks(self):
+        data = "съешь же ещё этих мягких французских булок".encode("utf-8") * 50
+        encoded = huffman.encode_bytes(data)
+        chunks = [encoded[i:i + 3] for i in range(0, len(encoded), 3)]
+        self.assertEqual(b"".join(huffman.decode_stream(chunks)), data)
+
+    def test_output_is_bit_packed(self):
+        data = b"ab" * 4096
+        encoded = huffman.encode_bytes(data)
+        # Два символа — по одному биту на символ
+        self.assertLess(len(encoded), len(data) // 8 + 64)
+
+    def test_codes_are_canonical_and_prefix_free(self):
+        lengths = huffman.code_lengths({ord("a"): 45, ord("b"): 13, ord("c"): 12, ord("d"): 16, ord("e"): 9, ord("f"): 5})
+        codes = [format(code, f"0{length}b") for code, length in huffman.canonical_codes(lengths).values()]
+        for code in codes:
+            self.assertFalse(any(other != code and other.startswith(code) for other in codes))
+
+    def test_rejects_garbage(self):
+        with self.assertRaises(huffman.HuffmanFormatError):
+            huffman.decode_bytes(b"not a huffman stream")
+        with self.assertRaises(huffman.HuffmanFormatError):
+            huffman.decode_bytes(huffman.encode_bytes(b"hello world")[:-2])
+        # У единственного символа код "0", ветви "1" в дереве нет
+        with self.assertRaises(huffman.HuffmanFormatError):
+            huffman.decode_bytes(huffman.encode_header(3, {ord("a"): 1}) + b"\xff")
+
+    def test_rejects_invalid_code_lengths(self):
+        tables = [
+            {ord("a"): 1, ord("b"): 1, ord("c"): 1},  # сумма 2^-длина больше 1
+            {ord("a"): 1, ord("b"): 5},  # длиннее, чем бывает при двух символах
+            {ord("a"): 2},  # единственный символ — только длина 1
+            {ord("a"): 0, ord("b"): 1},
+        ]
+        for lengths in tables:
+            with self.subTest(lengths=lengths):
+                with self.assertRaises(huffman.HuffmanFormatError):
+                    huffman.decode_bytes(huffman.encode_header(4, lengths) + b"\x00\x00")
+
+
+class HuffmanEndpointTests(ApiTestCase):
+    def setUp(self):
+        _, self.headers = self.register()
+
+    def decode(self, data):
+        return self.api.post("/documents/huffman/decode", headers=self.headers, files={"file": ("data.huf", data)})
+
+    def test_decodes_valid_stream(self):
+        data = "Привет, мир! Hello, world!".encode("utf-8") * 100
+        response = self.decode(huffman.encode_bytes(data))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, data)
+
+    def test_rejects_truncated_and_corrupt_body(self):
+        encoded = huffman.encode_bytes(b"hello world" * 1000)
+        for data in (
+            encoded[:-10],
+            encoded[:huffman.HEADER.size + 3],
+            huffman.encode_header(3, {ord("a"): 1}) + b"\xff",
+            huffman.encode_header(4, {ord("a"): 1, ord("b"): 1, ord("c"): 1}) + b"\x00",
+        ):
+            with self.subTest(size=len(data)):
+                self.assertEqual(self.decode(data).status_code, 400)
+
+
+class DocumentStorageTests(ApiTestCase):
+    def test_identical_content_is_stored_once(self):
+        _, first = self.register()
+        _, second = self.register()
+        content = f"одинаковое содержимое {uuid.uuid4()}".encode("utf-8")
+        first_id = self.upload(first, "a.txt", content)
+        second_id = self.upload(second, "b.txt", content)
+        path = self.query("SELECT path FROM main_document WHERE id = ?", (first_id,))["path"]
+        self.assertEqual(self.query("SELECT path FROM main_document WHERE id = ?", (second_id,))["path"], path)
+
+        self.assertEqual(self.api.delete(f"/documents/{first_id}", headers=first).status_code, 200)
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(self.api.delete(f"/documents/{second_id}", headers=second).status_code, 200)
+        self.assertFalse(os.path.exists(path))
+        self.assertIsNone(self.query("SELECT 1 FROM main_blob WHERE path = ?", (path,)))
+
+    def test_quota_exceeded(self):
+        _, headers = self.register()
+        with mock.patch.object(storage_usage, "STORAGE_QUOTA_MB", 0.001):
+            self.upload(headers, "small.txt", b"x" * 600)
+            response = self.api.post("/documents/upload", headers=headers, files={"file": ("big.txt", b"y" * 600)})
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(self.api.get("/documents/storage", headers=headers).json()["documents"], 1)
+
+    def test_bulk_upload_reports_each_file(self):
+        _, headers = self.register()
+        zip_data = io.BytesIO()
+        with zipfile.ZipFile(zip_data, "w", zipfile.ZIP_DEFLATED) as archive:
+            archive.writestr("docs/one.txt", "первый документ")
+            archive.writestr("docs/two.txt", "второй документ")
+        tar_data = io.BytesIO()
+        with tarfile.open(fileobj=tar_data, mode="w:gz") as archive:
+            info = tarfile.TarInfo("three.txt")
+            info.size = 6
+            archive.addfile(info, io.BytesIO(b"third!"))
+        response = self.api.post("/documents/upload/bulk", headers=headers, files=[
+            ("files", ("docs.zip", zip_data.getvalue())),
+            ("files", ("more.tar.gz", tar_data.getvalue())),
+            ("files", ("broken.zip", b"not a zip archive")),
+            ("files", ("plain.txt", b"plain text")),
+        ])
+        self.assertEqual(response.status_code, 200, response.text)
+        results = {result["filename"]: result["status"] for result in response.json()["results"]}
+        self.assertEqual(results, {
+            "docs/one.txt": "ok", "docs/two.txt": "ok", "three.txt": "ok", "broken.zip": "error", "plain.txt": "ok",
+        })
+        self.assertEqual(len(self.api.get("/documents/", headers=headers).json()), 4)
+
+
+class AuthTests(ApiTestCase):
+    def test_logout_and_password_change_revoke_tokens(self):
+        username, headers = self.register()
+        self.assertEqual(self.api.get("/users/logout", headers=headers).status_code, 200)
+        self.assertEqual(self.api.get("/documents/", headers=headers).status_code, 401)
+
+        headers = self.login(username, "secret-password")
+        response = self.api.patch("/users/update", headers=headers, json={"password": "another-password"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.api.get("/documents/", headers=headers).status_code, 401)
+        new_headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+        self.assertEqual(self.api.get("/documents/", headers=new_headers).status_code, 200)
+
+    def test_legacy_sha256_hash_is_upgraded_on_login(self):
+        username = f"legacy-{uuid.uuid4().hex[:12]}"
+        conn = database.get_db_connection()
+        conn.execute(
+            "INSERT INTO main_user (username, password) VALUES (?, ?)",
+            (username, hashlib.sha256(b"old-password").hexdigest())
+        )
+        conn.commit()
+        conn.close()
+
+        self.login(username, "old-password")
+        stored = self.query("SELECT password FROM main_user WHERE username = ?", (username,))["password"]
+        self.assertTrue(stored.startswith("$2"))
+        self.login(username, "old-password")
+
+
+class SearchTests(ApiTestCase):
+    def search(self, headers, q):
+        response = self.api.get("/documents/search", headers=headers, params={"q": q})
+        self.assertEqual(response.status_code, 200, response.text)
+        return [result["name"] for result in response.json()]
+
+    def test_results_are_scoped_to_owner(self):
+        _, first = self.register()
+        _, second = self.register()
+        word = f"уникальное{uuid.uuid4().hex[:8]}"
+        self.upload(first, "mine.txt", f"{word} текст".encode("utf-8"))
+        self.upload(second, "theirs.txt", f"{word} другой".encode("utf-8"))
+        self.assertEqual(self.search(first, word), ["mine.txt"])
+        self.assertEqual(self.search(second, word), ["theirs.txt"])
+
+        # Токен владельца в колонке owner не совпадает с обычным запросом
+        user_id = self.query("SELECT user_id FROM main_document WHERE name = 'mine.txt' ORDER BY id DESC")["user_id"]
+        self.assertEqual(self.search(first, f"u{user_id}"), [])
+
+
+class EncodingDetectionTests(SimpleTestCase):
+    russian = "Привет, мир! Съешь ещё этих мягких французских булок, да выпей же чаю."
+
+    def test_detects_encoding(self):
+        for encoding, expected in [
+            ("utf-8", "utf-8"),
+            ("utf-8-sig", "utf-8-sig"),
+            ("utf-16", "utf-16"),
+            ("cp1251", "cp1251"),
+            ("koi8-r", "koi8-r"),
+            ("cp866", "cp866"),
+        ]:
+            with self.subTest(encoding=encoding):
+                self.assertEqual(decoding.detect_bytes(self.russian.encode(encoding)), expected)
+
+    def test_western_text(self):
+        text = "Le café était très agréable, où nous avons déjeuné."
+        self.assertEqual(decoding.detect_bytes(text.encode("cp1252")), "cp1252")
+
+    def test_sample_cut_inside_character(self):
+        sample = self.russian.encode("utf-8")[:-1]
+        self.assertEqual(decoding.detect_bytes(sample, final=False), "utf-8")
+
+
+class StreamingTokenizerTests(SimpleTestCase):
+    text = ("Съешь ещё этих мягких булок, a b cd — word_with_underscore 42 x " + "я" * 300 + "\nВторая строка: ёжик, ежи.\n") * 7
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix=".txt")
+        with os.fdopen(handle, "w", encoding="utf-8") as f:
+            f.write(self.text)
+        self.addCleanup(os.remove, self.path)
+
+    def test_chunks_match_whole_text(self):
+        expected = tokenizer.tokenize(self.text)
+        for chunk_size in (1, 2, 3, 7, 64, 10 ** 6):
+            with self.subTest(chunk_size=chunk_size):
+                self.assertEqual(list(tokenizer.iter_tokens(self.path, chunk_size=chunk_size)), expected)
+
+    def test_counts_chars(self):
+        counts = tokenizer.count_chars(self.path, chunk_size=5)
+        self.assertEqual(sum(counts.values()), len(self.text))
+        self.assertEqual(counts["ё"], self.text.count("ё"))
+
+
+class TermCountsTests(SimpleTestCase):
+    def setUp(self):
+        self.vocabulary = term_counts.Vocabulary()
+        self.first = Counter({"мир": 3, "привет": 1, "data": 2})
+        self.second = Counter({"data": 5, "слово": 1})
+
+    def build(self, counter):
+        return term_counts.TermCounts.from_counter(self.vocabulary, counter)
+
+    def test_get_and_norm(self):
+        document = self.build(self.first)
+        self.build(self.second)
+        self.assertEqual(document.get("data"), 2)
+        self.assertEqual(document.get("слово"), 0)
+        self.assertEqual(document.get("нет"), 0)
+        self.assertAlmostEqual(document.norm(), 14 ** 0.5)
+
+    def test_top_k_breaks_ties_by_term(self):
+        counter = Counter({f"w{i:03d}": i % 7 + 1 for i in range(200)})
+        for k, largest in [(1, True), (10, True), (10, False), (500, False)]:
+            with self.subTest(k=k, largest=largest):
+                expected = sorted(counter.items(), key=lambda item: (-item[1] if largest else item[1], item[0]))[:k]
+                self.assertEqual(self.build(counter).top_k(k, largest), expected)
+
+    def test_bytes_roundtrip_into_another_vocabulary(self):
+        data = self.build(self.first).to_bytes()
+        restored = term_counts.TermCounts.from_bytes(term_counts.Vocabulary(), data)
+        self.assertEqual(restored.to_dict(), dict(self.first))
+        with self.assertRaises(term_counts.TermCountsFormatError):
+            term_counts.TermCounts.from_bytes(term_counts.Vocabulary(), data[:-20])
@@ -1,25 +1,13 @@
-import os
+from django.http import HttpResponse
 from django.shortcuts import render
 from .forms import UploadFileForm
-from sklearn.feature_extraction.text import TfidfVectorizer
-import chardet
+from fastapi_app.endpoints import analytics, compute
+from fastapi_app.endpoints.database import get_db_connection
+from fastapi_app.endpoints.storage_usage import GLOBAL_USAGE_ID, add_usage
 
 def process_file(file_field):
-    with open(file_field.path, "rb") as f:
-        raw_data = f.read()
-        result = chardet.detect(raw_data)
-        encoding = result["encoding"] if result["encoding"] else "utf-8"
-
-    with open(file_field.path, "r", encoding=encoding, errors="ignore") as f:
-        text = f.read()
-
-    words = text.split()
-    vectorizer = TfidfVectorizer()
-    tfidf_matrix = vectorizer.fit_transform([" ".join(words)])
-    tfidf_scores = dict(zip(vectorizer.get_feature_names_out(), tfidf_matrix.toarray()[0]))
-
-    sorted_tfidf = sorted(tfidf_scores.items(), key=lambda x: x[1], reverse=True)[:50]
-    return sorted_tfidf
+    # Разбор файла выполняется в пуле процессов, чтобы не занимать воркер uvicorn
+    return compute.run_sync(analytics.uploaded_file_tfidf, file_field.path)
 
 
 
@@ -28,7 +16,16 @@ def upload_file(request):
         form = UploadFileForm(request.POST, request.FILES)
         if form.is_valid():
             uploaded_file = form.save()  # Сохраняем файл в базе данных
-            result = process_file(uploaded_file.file)  # Обрабатываем файл
+            conn = get_db_connection()
+            add_usage(conn.cursor(), GLOBAL_USAGE_ID, uploaded_file.file.size)
+            conn.commit()
+            conn.close()
+            try:
+                result = process_file(uploaded_file.file)  # Обрабатываем файл
+            except compute.ComputeSaturated:
+                return HttpResponse("Сервер перегружен, повторите попытку позже", status=429)
+            except compute.ComputeTimeout:
+                return HttpResponse("Превышено время обработки файла", status=504)
             return render(request, "result.html", {"result": result})
     else:
         form = UploadFileForm()